@@ -2,6 +2,10 @@
 from __future__ import annotations
 
 import logging
+import os
+from collections import deque
+import tempfile
+import uuid
 import pandas as pd
 import streamlit as st
 
@@ -9,11 +13,17 @@ from config.settings import AppConfig
 from utils.logging_setup import setup_logging
 from services.best_sellers import fetch_best_sellers
 from services.product_details import build_stage2_dataframe
+from services.budget import get_usage_ledger
 from services.google_client import make_google_client
-from services.semantic import build_query, semantic_filter
-from services.url_filter import get_excluded_domains, filter_items_by_domain
+from services.http_client import host_stats
+from services.pipeline import has_budget, iter_stage3, link_columns
+from services.semantic import is_model_ready, warm_up_model
 
-from utils.data_ops import sanitize_for_stage3, df_to_csv_bytes, clean_text
+from utils.data_ops import (
+    ARROW_AVAILABLE, compact_frame, df_to_csv_download, df_to_parquet_download,
+    enable_copy_on_write, open_row_writer, read_stage3_csv, sanitize_for_stage3,
+)
+from utils.metrics import metrics
 
 # -------------------------
 # Page / App configuration
@@ -28,6 +38,8 @@ st.set_page_config(
 # App config & logging
 # -------------------------
 cfg = AppConfig()
+LIVE_TAIL_ROWS = 200  # Stage 3 live table shows only the latest rows while streaming
+enable_copy_on_write()
 mem_handler = setup_logging(logging.INFO)
 log = logging.getLogger("app")
 
@@ -43,6 +55,10 @@ st.sidebar.write(f"Country: **{cfg.COUNTRY}**  |  Language: **{cfg.LANGUAGE}**")
 st.sidebar.write("---")
 st.sidebar.caption("Google CSE")
 st.sidebar.write(f"Mode: **{cfg.GOOGLE_MODE}**  |  Threshold: **{cfg.GOOGLE_THRESHOLD}**  |  Max links/row: **{cfg.GOOGLE_MAX_LINKS}**  |  QPS: **{cfg.GOOGLE_QPS_TARGET}**")
+if cfg.GOOGLE_MODE == "real" and cfg.GOOGLE_DAILY_BUDGET > 0:
+    used = get_usage_ledger(cfg.GOOGLE_USAGE_PATH).used() if cfg.GOOGLE_USAGE_PATH else 0
+    st.sidebar.write(f"CSE budget today: **{used}/{cfg.GOOGLE_DAILY_BUDGET}** queries")
+st.sidebar.write(f"Semantic backend: **{cfg.SEMANTIC_BACKEND}**  |  Model: **{'ready' if is_model_ready() else 'loading…'}**")
 
 st.sidebar.write("---")
 if not (cfg.RAPIDAPI_KEY or cfg.AMAZON_API_KEY):
@@ -112,26 +128,14 @@ if fetch_btn:
 
             best = fetch_best_sellers(category_input.strip(), cfg)
 
-            stage_status.info("Normalizing results…")
-            stage_progress.progress(70)
-
-            # Ensure unique ASINs & sorted by rank
-            seen = set()
-            deduped = []
-            for row in best:
-                a = row["asin"]
-                if a not in seen:
-                    seen.add(a)
-                    deduped.append(row)
-            deduped = sorted(deduped, key=lambda r: r["rank"])
-
-            st.session_state["stage1_best"] = deduped
-            stage_status.success(f"Fetched {len(deduped)} items (asin + rank).")
+            # Service already returns unique ASINs sorted by rank
+            st.session_state["stage1_best"] = best
+            stage_status.success(f"Fetched {len(best)} items (asin + rank).")
             stage_progress.progress(100)
 
             with results_container:
                 st.caption("Stage 1 output preview (top 10):")
-                st.write(deduped[:10])
+                st.write(best[:10])
 
         except Exception as e:
             log.exception("Stage 1 failed")
@@ -165,7 +169,7 @@ if stage2_btn:
                 stage_status=stage_status,
                 stage_progress=stage_progress,
             )
-            df = sanitize_for_stage3(df)
+            df = compact_frame(sanitize_for_stage3(df, inplace=True), inplace=True)
             st.session_state["stage2_df"] = df
             stage_status.success(f"Stage 2 complete. Rows: {len(df)}")
             stage_progress.progress(100)
@@ -174,13 +178,22 @@ if stage2_btn:
                 st.caption("Stage 2 preview (top 20 by sales volume):")
                 st.dataframe(df.head(5), use_container_width=True)
                 # 🔽 NUEVO: Botón para descargar Stage 2 CSV
+                # Deferred: the file is only written when the button is clicked
                 st.download_button(
                     label="⬇️ Download Stage 2 CSV",
-                    data=df_to_csv_bytes(df),
+                    data=lambda df=df: df_to_csv_download(df),
                     file_name="stage2_products.csv",
                     mime="text/csv",
                     use_container_width=True,
                 )
+                if ARROW_AVAILABLE:
+                    st.download_button(
+                        label="⬇️ Download Stage 2 Parquet",
+                        data=lambda df=df: df_to_parquet_download(df),
+                        file_name="stage2_products.parquet",
+                        mime="application/vnd.apache.parquet",
+                        use_container_width=True,
+                    )
         except Exception as e:
             log.exception("Stage 2 failed")
             stage_status.error(f"Stage 2 failed: {e}")
@@ -210,6 +223,7 @@ if stage3_btn:
     if st.session_state.get("stage2_df") is None:
         st.error("Stage 2 table not found. Please run Stage 2 first.")
     else:
+        out_path = None
         try:
             render_stage_header("Stage 3 — Searching & filtering")
             stage_status.info("Initializing Stage 3…")
@@ -220,79 +234,118 @@ if stage3_btn:
             if hasattr(client, "usage"):
                 client.usage.qps_target = float(qps)
 
-            df2 = st.session_state["stage2_df"].copy()
-
-            # Prepare link columns
-            for j in range(int(max_links)):
-                col = f"link_{j+1}"
-                if col not in df2.columns:
-                    df2[col] = None
-
-            total = len(df2)
-            excluded = get_excluded_domains()
-            log.info("Applying server-side domain exclusions: %s", excluded)
-            for i, row in df2.iterrows():
-                brand = clean_text(row.get("brand"))
-                title = clean_text(row.get("product_title"))
-                target = f"{brand} {title}".strip() or title or brand
-                if not target:
-                    continue
-
-                stage_status.info(f"Stage 3: searching links ({i+1}/{total}) …")
-                stage_progress.progress(min(99, int(5 + ((i + 1) / max(1, total)) * 90)))
-
-                query = build_query(brand, title)
-                try:
-                    payload = client.search(query, exclude_domains=[], num=10)  # we filter after
-                    items = payload.get("items", []) or []
-                except Exception as e:
-                    log.warning("Google search failed for row %d: %s", i, e)
-                    items = []
-
-                filtered = semantic_filter(items, target_text=target, threshold=float(threshold))
-                # NEW: domain-level filter (no UI, code-controlled)
-                excluded = get_excluded_domains()
-                log.info("Applying server-side domain exclusions: %s", excluded)
-                filtered = filter_items_by_domain(filtered, excluded)   
-                from services.link_ranker import rank_links_by_brand
-
-                if brand and filtered:
-                    ranked = rank_links_by_brand(filtered, brand, threshold=75)
-                    filtered = ranked  # priorizamos solo esos links si hay coincidencia fuerte
-
-                for j in range(int(max_links)):
-                    df2.at[i, f"link_{j+1}"] = (filtered[j]["url"] if j < len(filtered) else None)
+            def _stage3_progress(message: str, pct: int) -> None:
+                stage_status.info(message)
+                stage_progress.progress(pct)
 
+            # Stream rows as they finish: appended to an on-disk CSV; the live table shows a bounded tail
+            df_in = st.session_state["stage2_df"]
+            columns = link_columns(df_in, int(max_links), deferred=has_budget(client))
+            out_path = os.path.join(tempfile.gettempdir(), f"stage3_{uuid.uuid4().hex}.csv")
+            with results_container:
+                st.caption(f"Stage 3 results (live, latest {LIVE_TAIL_ROWS} rows):")
+                live_table = st.empty()
+            stats = {}
+            tail = deque(maxlen=LIVE_TAIL_ROWS)
+            n_rows = 0
+            with open_row_writer(out_path, columns) as writer:
+                for i, record in iter_stage3(
+                    df_in,
+                    client,
+                    cfg,
+                    max_links=int(max_links),
+                    threshold=float(threshold),
+                    progress=_stage3_progress,
+                    stats=stats,
+                ):
+                    writer.write(record)
+                    tail.append(record)
+                    n_rows += 1
+                    if n_rows % cfg.STAGE3_CHUNK_ROWS == 0:
+                        live_table.dataframe(pd.DataFrame.from_records(list(tail), columns=columns), use_container_width=True)
+
+            # Final table comes from the file the writer produced (rows are yielded in table order)
+            df2 = read_stage3_csv(out_path, df_in)
+            df2.index = df_in.index
+            df2 = compact_frame(df2, inplace=True)
+            live_table.dataframe(df2, use_container_width=True)
             st.session_state["stage3_df"] = df2
-            # Requests made (works for simulate and real)
-            requests_made = getattr(getattr(client, "usage", None), "requests_made", "n/a")
-            stage_status.success(f"Stage 3 complete. Google requests: {requests_made}")
+            stage_status.success(
+                f"Stage 3 complete. Google requests: {stats['google_requests']} ({stats['queries_coalesced']} coalesced)  |  "
+                f"Rows from brand index: {stats['rows_from_brand_index']}  |  "
+                f"Deferred (CSE budget): {stats['rows_deferred']}  |  Failed searches: {stats['rows_failed']}  |  "
+                f"Embedding cache: {stats['embedding_hits']} hits / {stats['embedding_misses']} misses"
+            )
             stage_progress.progress(100)
 
             with results_container:
-                st.caption("Stage 3 preview (top 20):")
-                st.dataframe(df2.head(5), use_container_width=True)
-                st.download_button(
-                label="⬇️ Download Stage 3 CSV",
-                data=df_to_csv_bytes(df2),
-                file_name="stage3_with_links.csv",
-                mime="text/csv",
-                use_container_width=True,
-                 )
+                with open(out_path, "rb") as fh:
+                    st.download_button(
+                        label="⬇️ Download Stage 3 CSV",
+                        data=fh,
+                        file_name="stage3_with_links.csv",
+                        mime="text/csv",
+                        use_container_width=True,
+                    )
+                if ARROW_AVAILABLE:
+                    st.download_button(
+                        label="⬇️ Download Stage 3 Parquet",
+                        data=lambda df=df2: df_to_parquet_download(df),
+                        file_name="stage3_with_links.parquet",
+                        mime="application/vnd.apache.parquet",
+                        use_container_width=True,
+                    )
         except Exception as e:
             log.exception("Stage 3 failed")
             stage_status.error(f"Stage 3 failed: {e}")
             stage_progress.progress(0)
+        finally:
+            if out_path and os.path.exists(out_path):
+                os.remove(out_path)
 
 
 # -------------------------
 # Logs & quick stats
 # -------------------------
 with st.expander("Logs (latest)"):
-    for line in mem_handler.records[-300:]:
-        st.text(line)
+    colL1, colL2 = st.columns([1, 3])
+    with colL1:
+        # The buffer records at INFO and above (setup_logging level), so DEBUG is not offered
+        log_level = st.selectbox("Level", ["INFO", "WARNING", "ERROR"], index=0, key="log_level")
+    with colL2:
+        log_names = st.multiselect("Loggers", mem_handler.logger_names(), key="log_loggers")
+    lines = mem_handler.entries(level=logging.getLevelName(log_level), loggers=log_names, limit=300)
+    if lines:
+        st.code("\n".join(lines), language=None)
+    else:
+        st.caption("No matching log records.")
+
+with st.expander("Metrics (per stage)"):
+    summary = metrics.summary()
+    if not summary:
+        st.caption("No instrumented calls yet.")
+    else:
+        st.dataframe(pd.DataFrame(summary), use_container_width=True)
+        colM1, colM2, colM3 = st.columns([1, 1, 1])
+        with colM1:
+            st.download_button("⬇️ Metrics JSON", data=metrics.to_json(), file_name="metrics.json", mime="application/json")
+        with colM2:
+            st.download_button("⬇️ Prometheus text", data=metrics.to_prometheus(), file_name="metrics.prom", mime="text/plain")
+        with colM3:
+            if st.button("Reset metrics"):
+                metrics.reset()
+    hosts = host_stats()
+    if hosts:
+        st.caption("Outbound hosts (adaptive concurrency / circuit breaker):")
+        st.dataframe(pd.DataFrame.from_dict(hosts, orient="index"), use_container_width=True)
 
 if st.session_state.get("stage3_df") is not None:
     df3 = st.session_state["stage3_df"]
     total_links = (df3.filter(like="link_").notna()).sum().sum()
     st.caption(f"Total populated links: {int(total_links)}")
+
+# -------------------------
+# Background model warm-up (after the page has rendered; no-op once started)
+# -------------------------
+if cfg.SEMANTIC_WARMUP:
+    warm_up_model()
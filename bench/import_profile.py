@@ -0,0 +1,71 @@
+# bench/import_profile.py
+"""
+Cold-start import profile for the Stage 1/2 path of the app (python -X importtime in a fresh
+interpreter). Fails when the total exceeds the budget or when the semantic stack
+(torch / sentence_transformers) gets imported eagerly.
+
+    python -m bench.import_profile --budget-ms 2500 --top 15
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+from config.settings import AppConfig
+
+# Everything app.py imports before any stage runs
+STAGE1_MODULES = (
+    "streamlit", "pandas",
+    "config.settings", "utils.logging_setup", "utils.data_ops", "utils.metrics",
+    "services.best_sellers", "services.product_details", "services.google_client",
+    "services.pipeline", "services.semantic",
+)
+HEAVY_MODULES = ("torch", "sentence_transformers", "transformers")
+
+
+def profile_imports(modules=STAGE1_MODULES) -> List[Tuple[str, int, int]]:
+    """Returns (module, self_us, cumulative_us) per imported module, from -X importtime (module names indented by depth)."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = "; ".join(f"import {m}" for m in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=root, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        rows.append((name[1:].rstrip(), int(self_us), int(cum_us)))  # keep indentation = nesting depth
+    return rows
+
+
+def main(argv: List[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Import-time profile of the Stage 1 cold start.")
+    p.add_argument("--budget-ms", type=float, default=AppConfig().COLD_START_BUDGET_MS)
+    p.add_argument("--top", type=int, default=15)
+    args = p.parse_args(argv)
+
+    rows = profile_imports()
+    top_level = [r for r in rows if not r[0].startswith(" ")]  # -X importtime indents nested imports
+    total_ms = sum(cum for _, _, cum in top_level) / 1000.0
+    print(f"{'module':<50}{'self_ms':>10}{'cum_ms':>10}")
+    for name, self_us, cum_us in sorted(rows, key=lambda r: r[2], reverse=True)[:args.top]:
+        print(f"{name.strip():<50}{self_us / 1000:>10.1f}{cum_us / 1000:>10.1f}")
+    print(f"\nTotal cold-start import time: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    heavy = sorted({n.strip() for n, _, _ in rows if n.strip() in HEAVY_MODULES})
+    ok = total_ms <= args.budget_ms
+    if heavy:
+        print(f"FAIL: semantic stack imported eagerly: {', '.join(heavy)}")
+        ok = False
+    elif not ok:
+        print("FAIL: over budget")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# bench/mock_servers.py
+"""
+Local HTTP stand-ins for the RapidAPI endpoints (/best-sellers, /product-details) and the
+Google CSE endpoint (/customsearch/v1), with configurable latency, error and 429 rates.
+Payloads mimic the real ones in shape and size.
+
+    python -m bench.mock_servers --port 8765 --latency-ms 150 --rate-429 0.05
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+_WORDS = ("garden hose heavy duty expandable lightweight kink free brass fittings nozzle spray "
+          "outdoor patio lawn sprinkler rake shovel steel ergonomic handle weatherproof").split()
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 120.0
+    jitter_ms: float = 40.0
+    error_rate: float = 0.0      # share of requests answered with HTTP 500
+    rate_429: float = 0.0        # share of requests answered with HTTP 429
+    retry_after_s: float = 0.2   # Retry-After sent with 429s
+    total_items: int = 100       # best sellers available per category
+    seed: int = 7
+
+
+def _asin(category: str, rank: int) -> str:
+    return "B0" + hashlib.sha1(f"{category}:{rank}".encode()).hexdigest()[:8].upper()
+
+
+def _words(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(n))
+
+
+def best_sellers_payload(category: str, page: int, cfg: MockConfig) -> Dict[str, Any]:
+    start = (page - 1) * 50 + 1
+    end = min(cfg.total_items, start + 49)
+    items = []
+    for rank in range(start, end + 1):
+        rng = random.Random(f"{category}:{rank}")
+        asin = _asin(category, rank)
+        items.append({
+            "rank": rank, "asin": asin,
+            "product_title": _words(rng, 12).title(),
+            "product_price": f"${rng.randint(5, 200)}.99",
+            "product_star_rating": f"{rng.uniform(3, 5):.1f}",
+            "product_num_ratings": rng.randint(10, 50_000),
+            "product_url": f"https://www.amazon.com/dp/{asin}",
+            "product_photo": f"https://m.media-amazon.com/images/I/{asin}._AC_SL1500_.jpg",
+        })
+    return {"status": "OK", "request_id": f"mock-{page}", "data": {"category": category, "best_sellers": items}}
+
+
+def details_payload(asins: List[str], cfg: MockConfig) -> Dict[str, Any]:
+    data = []
+    for asin in asins:
+        rng = random.Random(asin)
+        brand = rng.choice(["Acme", "Flexzilla", "Gilmour", "Orbit", "Melnor", "Fiskars"])
+        data.append({
+            "asin": asin,
+            "product_title": f"{brand} {_words(rng, 10).title()}",
+            "sales_volume": rng.choice(["50+ bought in past month", "1K+ bought in past month", "10K+ bought in past month", None]),
+            "product_url": f"https://www.amazon.com/dp/{asin}",
+            "product_information": {"Brand Name": brand, "Item Weight": f"{rng.randint(1, 20)} Pounds"},
+            "product_details": {"Brand": brand, "Material": "Rubber"},
+            "about_product": [_words(rng, 40) for _ in range(5)],
+            "product_description": _words(rng, 300),
+        })
+    return {"status": "OK", "request_id": "mock-details", "data": data if len(data) != 1 else data[0]}
+
+
+def cse_payload(query: str, start: int, num: int) -> Dict[str, Any]:
+    rng = random.Random(f"{query}:{start}")
+    slug = "-".join(query.lower().split()[:4]) or "product"
+    domains = ["example-brand.com", "gardenreview.net", "homedepot.com", "lowes.com", "blog.example.org"]
+    if query.split():  # queries start with the brand: give it an official site among the results
+        domains.append(f"{re.sub(r'[^a-z0-9]', '', query.split()[0].lower()) or 'brand'}.com")
+    items = []
+    for n in range(start, start + num):
+        dom = rng.choice(domains)
+        items.append({
+            "kind": "customsearch#result",
+            "title": f"{query[:60]} — {_words(rng, 4)}",
+            "link": f"https://{dom}/{slug}/{n}",
+            "displayLink": dom,
+            "snippet": f"{query} {_words(rng, 25)}",
+            "pagemap": {"metatags": [{"og:description": _words(rng, 40)}]},
+        })
+    return {"kind": "customsearch#search", "searchInformation": {"totalResults": "1000"}, "items": items}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "MockServer"
+
+    def log_message(self, *args: Any) -> None:  # keep benchmark output clean
+        pass
+
+    def _send(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_GET(self) -> None:
+        cfg = self.server.cfg
+        with self.server.lock:
+            self.server.hits += 1
+            roll = self.server.rng.random()
+            delay = max(0.0, cfg.latency_ms + self.server.rng.uniform(-cfg.jitter_ms, cfg.jitter_ms)) / 1000.0
+        time.sleep(delay)
+        if roll < cfg.rate_429:
+            return self._send(429, {"message": "Too many requests"}, {"Retry-After": str(cfg.retry_after_s)})
+        if roll < cfg.rate_429 + cfg.error_rate:
+            return self._send(500, {"message": "Internal error"})
+
+        parts = urlsplit(self.path)
+        q = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        path = parts.path.rstrip("/")
+        if path.endswith("/best-sellers"):
+            return self._send(200, best_sellers_payload(q.get("category", ""), int(q.get("page", "1")), cfg))
+        if path.endswith("/product-details"):
+            return self._send(200, details_payload([a for a in q.get("asin", "").split(",") if a], cfg))
+        if path.endswith("/customsearch/v1"):
+            return self._send(200, cse_payload(q.get("q", ""), int(q.get("start", "1")), int(q.get("num", "10"))))
+        self._send(404, {"message": f"unknown path {path}"})
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cfg: MockConfig, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.cfg = cfg
+        self.lock = threading.Lock()
+        self.rng = random.Random(cfg.seed)
+        self.hits = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def start_mock_server(cfg: Optional[MockConfig] = None, port: int = 0) -> Tuple[MockServer, str]:
+    """Start a mock server in a background thread; returns (server, base_url)."""
+    server = MockServer(cfg or MockConfig(), port=port).start()
+    return server, server.base_url
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Serve mock RapidAPI + Google CSE endpoints.")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency-ms", type=float, default=120.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--rate-429", type=float, default=0.0)
+    args = p.parse_args()
+    server = MockServer(MockConfig(latency_ms=args.latency_ms, error_rate=args.error_rate, rate_429=args.rate_429), port=args.port)
+    print(f"Mock servers on {server.base_url} (RapidAPI base: {server.base_url}, CSE: {server.base_url}/customsearch/v1)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# bench/run_bench.py
+"""
+Offline end-to-end benchmark: drives the real Stage 1/2/3 service functions against the local
+mock servers and reports per-stage wall time, requests/s, p50/p95 request latency and peak RSS.
+
+    python -m bench.run_bench --latency-ms 150 --rate-429 0.02 --items 100 --json bench.json
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+# Local stores live in a throwaway directory: mock brands, responses and embeddings must never reach
+# the real .cache/. Set before config.settings is imported, since the embedding cache builds its own AppConfig().
+STATE_DIR = tempfile.mkdtemp(prefix="bench-")
+os.environ["EMBED_CACHE_DIR"] = os.path.join(STATE_DIR, "embeddings")
+
+from bench.mock_servers import MockConfig, start_mock_server
+from config.settings import AppConfig
+from services.best_sellers import fetch_best_sellers
+from services.google_client import RealGoogleClient
+from services.http_client import get_session
+from services.pipeline import iter_stage3
+from services.product_details import build_stage2_dataframe
+from utils.data_ops import sanitize_for_stage3
+from utils.metrics import metrics
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values: return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class _Recorder:
+    """Collects client-side latency of every response on the shared session, per stage."""
+    def __init__(self) -> None:
+        self.stage = "setup"
+        self.latencies: Dict[str, List[float]] = {}
+        self.bytes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def hook(self, resp: Any, *args: Any, **kwargs: Any) -> None:
+        with self._lock:
+            self.latencies.setdefault(self.stage, []).append(resp.elapsed.total_seconds())
+            self.bytes[self.stage] = self.bytes.get(self.stage, 0) + len(resp.content or b"")
+
+
+def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    mock_cfg = MockConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                          rate_429=args.rate_429, total_items=args.items)
+    server, base_url = start_mock_server(mock_cfg)
+    cfg = dataclasses.replace(
+        AppConfig(),
+        RAPIDAPI_KEY="bench", API_BASE_URL=base_url,
+        GOOGLE_MODE="real", GOOGLE_API_KEY="bench", GOOGLE_CSE_CX="bench",
+        GOOGLE_URL=f"{base_url}/customsearch/v1", GOOGLE_QPS_TARGET=args.qps,
+        GOOGLE_DAILY_BUDGET=0, GOOGLE_USAGE_PATH="",  # mock searches never touch the real CSE quota
+        MAX_BEST_ITEMS=args.items, RESPONSE_CACHE_ENABLED=args.cache, ASIN_STORE_ENABLED=args.cache,
+        BRAND_INDEX_ENABLED=args.cache,
+        RESPONSE_CACHE_PATH=os.path.join(STATE_DIR, "responses.sqlite"),
+        ASIN_STORE_PATH=os.path.join(STATE_DIR, "asin_details.sqlite"),
+        BRAND_INDEX_PATH=os.path.join(STATE_DIR, "brand_domains.sqlite"),
+        EMBED_CACHE_DIR=os.environ["EMBED_CACHE_DIR"],
+        HTTP_BACKOFF_S=0.05,
+    )
+    rec = _Recorder()
+    get_session().hooks["response"].append(rec.hook)
+    report: List[Dict[str, Any]] = []
+
+    def _stage(name: str, fn):
+        rec.stage = name
+        t0 = time.perf_counter()
+        out = fn()
+        wall = time.perf_counter() - t0
+        lat = rec.latencies.get(name, [])
+        report.append({
+            "stage": name, "wall_s": round(wall, 3), "requests": len(lat),
+            "rps": round(len(lat) / wall, 2) if wall > 0 else 0.0,
+            "p50_ms": round(percentile(lat, 50) * 1000, 1), "p95_ms": round(percentile(lat, 95) * 1000, 1),
+            "bytes": rec.bytes.get(name, 0), "peak_rss_mb": round(peak_rss_mb(), 1),
+        })
+        return out
+
+    try:
+        best = _stage("stage1", lambda: fetch_best_sellers(args.category, cfg))
+        df = _stage("stage2", lambda: sanitize_for_stage3(build_stage2_dataframe(best, cfg), inplace=True))
+        client = RealGoogleClient(cfg)
+        _stage("stage3", lambda: sum(1 for _ in iter_stage3(df, client, cfg, cfg.GOOGLE_MAX_LINKS, cfg.GOOGLE_THRESHOLD)))
+    finally:
+        get_session().hooks["response"].remove(rec.hook)
+        server.stop()
+        shutil.rmtree(STATE_DIR, ignore_errors=True)
+    return report
+
+
+def main(argv: List[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Offline Stage 1/2/3 benchmark against local mock servers.")
+    p.add_argument("--category", default="lawn-garden/3737941")
+    p.add_argument("--items", type=int, default=100, help="Best sellers to process (MAX_BEST_ITEMS)")
+    p.add_argument("--latency-ms", type=float, default=120.0)
+    p.add_argument("--jitter-ms", type=float, default=40.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--rate-429", type=float, default=0.0)
+    p.add_argument("--qps", type=float, default=10.0, help="Google QPS target")
+    p.add_argument("--cache", action="store_true", help="Keep the local response cache, ASIN detail store and brand->domain index enabled (in a temp dir)")
+    p.add_argument("--json", dest="json_path", help="Also write the report as JSON to this path")
+    args = p.parse_args(argv)
+
+    report = run(args)
+    print(f"{'stage':<8}{'wall_s':>9}{'reqs':>7}{'rps':>8}{'p50_ms':>9}{'p95_ms':>9}{'MB recv':>9}{'peak_rss':>10}")
+    for r in report:
+        print(f"{r['stage']:<8}{r['wall_s']:>9.3f}{r['requests']:>7}{r['rps']:>8.1f}{r['p50_ms']:>9.1f}"
+              f"{r['p95_ms']:>9.1f}{r['bytes'] / 1e6:>9.2f}{r['peak_rss_mb']:>10.1f}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "stages": report, "spans": metrics.summary()}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
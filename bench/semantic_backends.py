@@ -0,0 +1,39 @@
+# bench/semantic_backends.py
+"""
+Compare semantic inference backends against the PyTorch baseline on the fixed drift sample.
+
+    python -m bench.semantic_backends --threshold 0.5
+
+A backend is safe to select (SEMANTIC_BACKEND) when it reports 0 decision flips at the
+configured GOOGLE_THRESHOLD; pick the fastest of those.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import List
+
+from config.settings import AppConfig
+from services.semantic import BACKENDS, evaluate_backend_drift
+
+
+def main(argv: List[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Semantic backend accuracy drift vs. torch baseline.")
+    p.add_argument("--threshold", type=float, default=AppConfig().GOOGLE_THRESHOLD)
+    p.add_argument("--backends", nargs="*", default=[b for b in BACKENDS if b != "torch"])
+    args = p.parse_args(argv)
+
+    print(f"{'backend':<8}{'max_diff':>10}{'mean_diff':>11}{'flips':>7}{'torch_s':>9}{'backend_s':>11}")
+    for backend in args.backends:
+        try:
+            r = evaluate_backend_drift(backend, threshold=args.threshold)
+        except Exception as e:  # e.g. onnxruntime/optimum not installed
+            print(f"{backend:<8}  unavailable: {e}")
+            continue
+        print(f"{r['backend']:<8}{r['max_abs_diff']:>10.4f}{r['mean_abs_diff']:>11.4f}{r['decision_flips']:>7d}"
+              f"{r['baseline_encode_s']:>9.3f}{r['backend_encode_s']:>11.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,6 +12,7 @@ class AppConfig:
     RAPIDAPI_KEY: str = os.getenv("RAPIDAPI_KEY", "")
     AMAZON_API_KEY: str = os.getenv("AMAZON_API_KEY", "")
     API_HOST: str = os.getenv("API_HOST", "real-time-amazon-data.p.rapidapi.com")
+    API_BASE_URL: str = os.getenv("API_BASE_URL", "")  # override, e.g. a local mock server
     COUNTRY: str = os.getenv("COUNTRY", "US")
     LANGUAGE: str = os.getenv("LANGUAGE", "en_US")
 
@@ -19,11 +20,52 @@ class AppConfig:
     GOOGLE_MODE: str = os.getenv("GOOGLE_MODE", "simulate").lower()  # simulate | real
     GOOGLE_API_KEY: str = os.getenv("GOOGLE_API_KEY", "")
     GOOGLE_CSE_CX: str = os.getenv("GOOGLE_CSE_CX", "")
-    GOOGLE_URL: str = "https://www.googleapis.com/customsearch/v1"
+    GOOGLE_URL: str = os.getenv("GOOGLE_URL", "https://www.googleapis.com/customsearch/v1")
 
     # App behavior
-    MAX_BEST_ITEMS: int = 50
+    MAX_BEST_ITEMS: int = int(os.getenv("MAX_BEST_ITEMS", "50"))
     DETAILS_BATCH_SIZE: int = 10
+    DETAILS_CONCURRENCY: int = int(os.getenv("DETAILS_CONCURRENCY", "4"))  # batches in flight
+    ASIN_STORE_ENABLED: bool = os.getenv("ASIN_STORE_ENABLED", "1") == "1"
+    ASIN_STORE_PATH: str = os.getenv("ASIN_STORE_PATH", ".cache/asin_details.sqlite")
+    DETAILS_MAX_AGE_S: float = float(os.getenv("DETAILS_MAX_AGE_S", str(7 * 24 * 3600)))  # refetch details older than this
+    HTTP_MAX_RETRIES: int = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+    HTTP_BACKOFF_S: float = float(os.getenv("HTTP_BACKOFF_S", "1.0"))
+    HTTP_MAX_CONCURRENCY: int = int(os.getenv("HTTP_MAX_CONCURRENCY", "8"))  # per host; AIMD adapts below this
+    HTTP_BREAKER_FAILURES: int = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))  # consecutive failures to open a host's breaker
+    HTTP_BREAKER_COOLDOWN_S: float = float(os.getenv("HTTP_BREAKER_COOLDOWN_S", "30"))
     GOOGLE_MAX_LINKS: int = 3
     GOOGLE_THRESHOLD: float = 0.50
     GOOGLE_QPS_TARGET: float = 8.0  # ≤ 10
+    CSE_MAX_PAGES: int = int(os.getenv("CSE_MAX_PAGES", "1"))  # per-row page budget; >1 opts in to fetching later pages for rows short of links (up to N queries/row)
+    GOOGLE_DAILY_BUDGET: int = int(os.getenv("GOOGLE_DAILY_BUDGET", "0"))  # CSE queries per day (Pacific time); 0 = unlimited
+    GOOGLE_USAGE_PATH: str = os.getenv("GOOGLE_USAGE_PATH", ".cache/cse_usage.sqlite")  # daily usage ledger, used when a budget is set ("" = in memory)
+    GOOGLE_CONCURRENCY: int = int(os.getenv("GOOGLE_CONCURRENCY", "8"))  # searches in flight
+    BRAND_INDEX_ENABLED: bool = os.getenv("BRAND_INDEX_ENABLED", "1") == "1"
+    BRAND_INDEX_PATH: str = os.getenv("BRAND_INDEX_PATH", ".cache/brand_domains.sqlite")
+    BRAND_INDEX_MIN_CONFIDENCE: float = float(os.getenv("BRAND_INDEX_MIN_CONFIDENCE", "0.8"))  # below this, search as usual
+    BRAND_INDEX_TTL_S: float = float(os.getenv("BRAND_INDEX_TTL_S", str(30 * 24 * 3600)))
+    STAGE3_CHUNK_ROWS: int = int(os.getenv("STAGE3_CHUNK_ROWS", "25"))  # rows per search/encode round
+    SEMANTIC_BACKEND: str = os.getenv("SEMANTIC_BACKEND", "torch").lower()  # torch | onnx | int8
+    SEMANTIC_WARMUP: bool = os.getenv("SEMANTIC_WARMUP", "1") == "1"  # load the model in the background after first render
+    COLD_START_BUDGET_MS: float = float(os.getenv("COLD_START_BUDGET_MS", "2500"))  # Stage 1 import budget (bench/import_profile.py)
+    SEMANTIC_BATCH_SIZE: int = int(os.getenv("SEMANTIC_BATCH_SIZE", "64"))
+    EMBED_CACHE_DIR: str = os.getenv("EMBED_CACHE_DIR", ".cache/embeddings")
+    EMBED_CACHE_MAX_ITEMS: int = int(os.getenv("EMBED_CACHE_MAX_ITEMS", "100000"))
+    EMBED_SERVER_SOCKET: str = os.getenv("EMBED_SERVER_SOCKET", "")  # Unix socket of services/embed_server.py; "" = encode in-process
+    EMBED_SERVER_WINDOW_MS: float = float(os.getenv("EMBED_SERVER_WINDOW_MS", "5"))  # micro-batching window
+    EMBED_SERVER_MAX_BATCH: int = int(os.getenv("EMBED_SERVER_MAX_BATCH", "256"))
+
+    # Local response cache (RapidAPI + Google CSE)
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+    RESPONSE_CACHE_OFFLINE: bool = os.getenv("RESPONSE_CACHE_OFFLINE", "0") == "1"  # replay only, never call out
+    RESPONSE_CACHE_PATH: str = os.getenv("RESPONSE_CACHE_PATH", ".cache/responses.sqlite")
+    RESPONSE_CACHE_MAX_MB: int = int(os.getenv("RESPONSE_CACHE_MAX_MB", "200"))
+    CACHE_TTL_BEST_SELLERS_S: float = float(os.getenv("CACHE_TTL_BEST_SELLERS_S", "3600"))
+    CACHE_TTL_DETAILS_S: float = float(os.getenv("CACHE_TTL_DETAILS_S", "3600"))
+    CACHE_TTL_GOOGLE_S: float = float(os.getenv("CACHE_TTL_GOOGLE_S", "86400"))
+
+    def api_url(self, path: str) -> str:
+        """RapidAPI endpoint URL (https://API_HOST/<path> unless API_BASE_URL is set)."""
+        base = (self.API_BASE_URL or f"https://{self.API_HOST}").rstrip("/")
+        return f"{base}/{path.lstrip('/')}"
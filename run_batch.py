@@ -0,0 +1,73 @@
+# run_batch.py
+"""
+Headless batch runner: Stage 1 -> 2 -> 3 for every category path in a file, no Streamlit UI.
+
+    python run_batch.py categories.txt --out-dir results/ --workers 4
+
+One category path per line (e.g. lawn-garden/3737941); blank lines and '#' comments are ignored.
+Writes <out-dir>/<category-slug>.csv (or .parquet) per category, row by row as Stage 3 progresses. Progress is checkpointed per category,
+stage and Stage 3 row, so re-running the same command resumes where it stopped.
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+from typing import List
+
+from config.settings import AppConfig
+from utils.logging_setup import setup_logging
+from services.checkpoints import CheckpointStore
+from services.scheduler import JobOptions, run_jobs
+
+log = logging.getLogger("run_batch")
+
+
+def read_categories(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.split("#", 1)[0].strip() for line in f]
+    return [c for c in lines if c]
+
+
+def main(argv: List[str] | None = None) -> int:
+    cfg = AppConfig()
+    p = argparse.ArgumentParser(description="Run the Best Sellers pipeline (Stage 1 → 2 → 3) headless.")
+    p.add_argument("categories_file", help="Text file with one category path per line")
+    p.add_argument("--out-dir", default="results", help="Directory for per-category result files")
+    p.add_argument("--format", choices=["csv", "parquet"], default="csv", help="Result file format")
+    p.add_argument("--max-links", type=int, default=cfg.GOOGLE_MAX_LINKS)
+    p.add_argument("--threshold", type=float, default=cfg.GOOGLE_THRESHOLD)
+    p.add_argument("--qps", type=float, default=cfg.GOOGLE_QPS_TARGET,
+                   help="CSE queries/second for the whole run (max 10), split evenly across --workers")
+    p.add_argument("--workers", type=int, default=1, help="Worker processes (model loaded once per worker)")
+    p.add_argument("--checkpoint", default=".cache/checkpoints.sqlite", help="Checkpoint store path")
+    p.add_argument("--fresh", action="store_true", help="Discard existing checkpoints before running")
+    args = p.parse_args(argv)
+
+    setup_logging(logging.INFO)
+    categories = read_categories(args.categories_file)
+    if not categories:
+        log.error("No categories found in %s", args.categories_file)
+        return 2
+    if args.fresh:
+        CheckpointStore(args.checkpoint).clear()
+
+    opts = JobOptions(
+        out_dir=args.out_dir,
+        checkpoint_path=args.checkpoint,
+        max_links=args.max_links,
+        threshold=args.threshold,
+        qps=args.qps,
+        out_format=args.format,
+    )
+    results = run_jobs(categories, opts, workers=args.workers)
+
+    failed = [r for r in results if r["status"] == "failed"]
+    partial = [r for r in results if r["status"] == "partial"]
+    log.info("Done: %d ok, %d partial (CSE budget spent or searches failed; rerun to resume), %d failed",
+             len(results) - len(failed) - len(partial), len(partial), len(failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
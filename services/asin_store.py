@@ -0,0 +1,53 @@
+# services/asin_store.py
+from __future__ import annotations
+import json, logging, time
+from typing import Any, Dict, Iterable, Optional, Tuple
+from config.settings import AppConfig
+from utils.sqlite_store import SQLiteStore, StoreRegistry
+
+log = logging.getLogger(__name__)
+
+class AsinDetailStore(SQLiteStore):
+    """
+    Persistent Product Details per (ASIN, country) with the time they were fetched, so Stage 2
+    only asks RapidAPI for ASINs that are new or older than the staleness window.
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS details ("
+        " asin TEXT, country TEXT, fetched_at REAL, payload TEXT, PRIMARY KEY (asin, country))",
+    )
+
+    def lookup(self, asins: Iterable[str], country: str, max_age_s: float) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+        """Returns (fresh, stale): asin -> stored payload, split by the staleness window. Missing ASINs are in neither."""
+        asins = list(asins)
+        fresh: Dict[str, Dict[str, Any]] = {}
+        stale: Dict[str, Dict[str, Any]] = {}
+        if not asins: return fresh, stale
+        cutoff = time.time() - max_age_s
+        with self._lock:
+            for start in range(0, len(asins), 500):  # stay under SQLite's parameter limit
+                chunk = asins[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                for asin, fetched_at, payload in self._conn.execute(
+                    f"SELECT asin, fetched_at, payload FROM details WHERE country=? AND asin IN ({marks})",
+                    [country, *chunk],
+                ):
+                    (fresh if fetched_at >= cutoff else stale)[asin] = json.loads(payload)
+        return fresh, stale
+
+    def put_many(self, country: str, items: Iterable[Dict[str, Any]]) -> int:
+        now = time.time()
+        rows = [(str(it["asin"]).strip(), country, now, json.dumps(it)) for it in items if it and it.get("asin")]
+        if not rows: return 0
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO details(asin, country, fetched_at, payload) VALUES (?,?,?,?)", rows
+            )
+            self._conn.commit()
+        return len(rows)
+
+_stores: StoreRegistry[AsinDetailStore] = StoreRegistry(AsinDetailStore)
+
+def get_asin_store(cfg: AppConfig) -> Optional[AsinDetailStore]:
+    """The process-wide store at cfg.ASIN_STORE_PATH (None with ASIN_STORE_ENABLED off)."""
+    return _stores.get(cfg.ASIN_STORE_PATH) if cfg.ASIN_STORE_ENABLED else None
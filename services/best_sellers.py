@@ -1,12 +1,18 @@
 # services/best_sellers.py
 from __future__ import annotations
-import json, time, logging, requests
+import json, math, logging, requests
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional
 from config.settings import AppConfig
+from services.http_client import HostPolicy, get_with_retry
+from services.response_cache import get_response_cache, make_cache_key
+from utils.metrics import instrumented, metrics
 from utils.typing import BestSellerRow
 
 log = logging.getLogger(__name__)
 
+PAGE_SIZE = 50  # items per Best Sellers page
+
 def _to_int(v: Any) -> Optional[int]:
     try: return int(str(v).strip())
     except Exception: return None
@@ -22,6 +28,44 @@ def _normalize_best(payload: Dict[str, Any]) -> List[BestSellerRow]:
             out.append({"asin": str(asin).strip(), "rank": rank})
     return out
 
+@instrumented("best_sellers_page", "stage1")
+def _fetch_page(url: str, headers: Dict[str, str], params: Dict[str, Any], cfg: AppConfig) -> List[BestSellerRow]:
+    cache = get_response_cache(cfg)
+    key = make_cache_key(url, params)
+    if cache:
+        cached = cache.get(key, cfg.CACHE_TTL_BEST_SELLERS_S)
+        metrics.current().cache = "miss" if cached is None else "hit"
+        if cached is not None:
+            log.info("BestSellers: cache hit params=%s", params)
+            return _normalize_best(cached)
+
+    log.info("BestSellers: GET %s params=%s", url, params)
+    try:
+        resp = get_with_retry(
+            url, headers=headers, params=params, timeout=60,
+            max_retries=cfg.HTTP_MAX_RETRIES, backoff=cfg.HTTP_BACKOFF_S, policy=HostPolicy.from_config(cfg),
+        )
+        payload = resp.json()
+    except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as e:
+        log.warning("BestSellers network error (page %s): %s", params.get("page"), e)
+        return []
+    except (json.JSONDecodeError, requests.JSONDecodeError):
+        raise ValueError("BestSellers: invalid JSON")
+    if payload.get("status") != "OK":
+        raise ValueError(f"API status != OK (status={payload.get('status')})")
+    if cache: cache.put(key, "best-sellers", payload)
+    return _normalize_best(payload)
+
+def _dedupe_by_asin(rows: List[BestSellerRow]) -> List[BestSellerRow]:
+    """Keep one row per ASIN (best rank wins), sorted by rank."""
+    best: Dict[str, BestSellerRow] = {}
+    for r in rows:
+        cur = best.get(r["asin"])
+        if cur is None or r["rank"] < cur["rank"]:
+            best[r["asin"]] = r
+    return sorted(best.values(), key=lambda r: r["rank"])
+
+@instrumented("best_sellers", "stage1")
 def fetch_best_sellers(category: str, cfg: AppConfig) -> List[BestSellerRow]:
     if not (cfg.RAPIDAPI_KEY or cfg.AMAZON_API_KEY):
         raise RuntimeError("Missing RAPIDAPI_KEY / AMAZON_API_KEY.")
@@ -30,33 +74,27 @@ def fetch_best_sellers(category: str, cfg: AppConfig) -> List[BestSellerRow]:
         "x-rapidapi-key": cfg.RAPIDAPI_KEY or cfg.AMAZON_API_KEY,
         "x-rapidapi-host": cfg.API_HOST,
     }
-    url = f"https://{cfg.API_HOST}/best-sellers"
+    url = cfg.api_url("best-sellers")
 
+    # All pages needed for MAX_BEST_ITEMS are requested at once. After the first short (or failed)
+    # page the pool is shut down without waiting: later pages are discarded, not waited for.
+    n_pages = max(1, math.ceil(cfg.MAX_BEST_ITEMS / PAGE_SIZE))
     collected: List[BestSellerRow] = []
-    page = 1
-    while len(collected) < cfg.MAX_BEST_ITEMS:
-        params = dict(category=category, country=cfg.COUNTRY, language=cfg.LANGUAGE, page=page)
-        log.info("BestSellers: GET %s params=%s", url, params)
-        chunk = []
-        for attempt in range(2):
-            try:
-                resp = requests.get(url, headers=headers, params=params, timeout=60)
-                resp.raise_for_status()
-                payload = resp.json()
-                if payload.get("status") != "OK":
-                    raise ValueError(f"API status != OK (status={payload.get('status')})")
-                chunk = _normalize_best(payload)
-                collected.extend(chunk)
+    pool = ThreadPoolExecutor(max_workers=n_pages, thread_name_prefix="bestsellers")
+    try:
+        futures = [
+            pool.submit(_fetch_page, url, headers,
+                        dict(category=category, country=cfg.COUNTRY, language=cfg.LANGUAGE, page=page), cfg)
+            for page in range(1, n_pages + 1)
+        ]
+        for fut in futures:
+            chunk = fut.result()
+            collected.extend(chunk)
+            if len(chunk) < PAGE_SIZE:
                 break
-            except (requests.HTTPError, requests.ConnectionError) as e:
-                log.warning("BestSellers network error (attempt %s): %s", attempt+1, e)
-                time.sleep(1.5)
-            except json.JSONDecodeError:
-                raise ValueError("BestSellers: invalid JSON")
-        if not chunk or len(chunk) < 50:
-            break
-        page += 1
-
-    collected = sorted(collected, key=lambda r: r["rank"])[:cfg.MAX_BEST_ITEMS]
-    log.info("BestSellers: collected=%d", len(collected))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    collected = _dedupe_by_asin(collected)[:cfg.MAX_BEST_ITEMS]
+    log.info("BestSellers: collected=%d (pages requested=%d)", len(collected), n_pages)
     return collected
@@ -0,0 +1,164 @@
+# services/brand_index.py
+from __future__ import annotations
+import json, logging, time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+from config.settings import AppConfig
+from services.link_ranker import registrable_domain
+from utils.sqlite_store import SQLiteStore, StoreRegistry
+
+log = logging.getLogger(__name__)
+
+SCORE_HISTORY = 20   # brand/domain scores kept per brand
+MIN_AGREEING = 3     # runs agreeing on the same domain before confidence can reach 1.0
+
+def normalize_brand(brand: Optional[str]) -> str:
+    return " ".join(str(brand or "").lower().split())
+
+def url_domain(url: str) -> str:
+    host = urlparse(url).netloc.lower().split(":", 1)[0]
+    return registrable_domain(host) if host else ""
+
+@dataclass
+class BrandEntry:
+    brand: str
+    domain: str
+    confidence: float
+    observations: int
+    agreeing: int
+    scores: List[int]
+    updated_at: float
+
+def _confidence(agreeing: int, observations: int, scores: Sequence[int]) -> float:
+    """Share of runs that agreed on the domain x mean brand/domain score, damped until MIN_AGREEING runs agree."""
+    if not observations or not scores: return 0.0
+    mean = sum(scores) / len(scores) / 100.0
+    return round((agreeing / observations) * mean * min(1.0, agreeing / MIN_AGREEING), 4)
+
+class BrandDomainIndex(SQLiteStore):
+    """
+    Persistent brand -> official domain index learned from Stage 3 runs (one vote per brand per
+    run, for its rows' top brand-ranked domain, from live searches only: results replayed from
+    the response cache are not new evidence), with the score history and a confidence value per
+    brand, plus the last official-domain links seen per ASIN. Stage 3 answers ASINs of confident,
+    unexpired brands that have stored links from here instead of running a Google search.
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS brands ("
+        " brand TEXT PRIMARY KEY, domain TEXT, confidence REAL, observations INTEGER,"
+        " agreeing INTEGER, scores TEXT, updated_at REAL)",
+        "CREATE TABLE IF NOT EXISTS asin_links ("
+        " asin TEXT PRIMARY KEY, brand TEXT, links TEXT, updated_at REAL)",
+    )
+
+    def _get(self, brands: Sequence[str]) -> Dict[str, BrandEntry]:
+        out: Dict[str, BrandEntry] = {}
+        for start in range(0, len(brands), 500):  # stay under SQLite's parameter limit
+            chunk = brands[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            for b, d, c, n, a, s, t in self._conn.execute(
+                f"SELECT brand, domain, confidence, observations, agreeing, scores, updated_at FROM brands WHERE brand IN ({marks})",
+                list(chunk),
+            ):
+                out[b] = BrandEntry(b, d, c, n, a, json.loads(s), t)
+        return out
+
+    def lookup(self, brands: Iterable[str], min_confidence: float, ttl_s: float) -> Dict[str, BrandEntry]:
+        """Entries (by normalized brand) that are confident enough and younger than `ttl_s`."""
+        keys = sorted({normalize_brand(b) for b in brands} - {""})
+        if not keys: return {}
+        cutoff = time.time() - ttl_s
+        with self._lock:
+            found = self._get(keys)
+        return {b: e for b, e in found.items() if e.domain and e.confidence >= min_confidence and e.updated_at >= cutoff}
+
+    def links_for(self, asins: Iterable[str], ttl_s: float) -> Dict[str, List[str]]:
+        """Official-domain links last seen per ASIN (within `ttl_s`)."""
+        asins = [a for a in dict.fromkeys(asins) if a]
+        out: Dict[str, List[str]] = {}
+        cutoff = time.time() - ttl_s
+        with self._lock:
+            for start in range(0, len(asins), 500):
+                chunk = asins[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                for asin, links, t in self._conn.execute(
+                    f"SELECT asin, links, updated_at FROM asin_links WHERE asin IN ({marks})", chunk,
+                ):
+                    if t >= cutoff:
+                        out[asin] = json.loads(links)
+        return out
+
+    def observe(self, rows: Iterable[Tuple[str, Optional[str], List[Dict[str, Any]]]], threshold: int) -> int:
+        """
+        Learn from one Stage 3 run's ranked rows: (brand, asin or None, links ranked by
+        `rank_links_by_brand`). A row's winner is its top link's registrable domain if it scores
+        >= `threshold`. Each call is one observation per brand, however many rows the brand had
+        (variants of one product often share a single coalesced search): the brand votes for its
+        most common winning domain, or for none if no row had a winner.
+        """
+        per_brand: Dict[str, List[Tuple[Optional[str], Optional[str], Optional[int], List[str]]]] = {}
+        for brand, asin, ranked in rows:
+            b = normalize_brand(brand)
+            if not b: continue
+            top = ranked[0] if ranked else None
+            if top and top.get("url") and top.get("brand_domain_score", 0) >= threshold:
+                domain = url_domain(top["url"])
+                links = [it["url"] for it in ranked if it.get("url") and url_domain(it["url"]) == domain]
+                per_brand.setdefault(b, []).append((asin, domain, int(top["brand_domain_score"]), links))
+            else:
+                per_brand.setdefault(b, []).append((asin, None, None, []))
+        if not per_brand: return 0
+
+        votes: Dict[str, Tuple[Optional[str], Optional[int]]] = {}
+        for b, brand_rows in per_brand.items():
+            tally: Dict[str, List[int]] = {}
+            for _, domain, score, _ in brand_rows:
+                if domain: tally.setdefault(domain, []).append(score)
+            if tally:
+                domain = max(tally, key=lambda d: (len(tally[d]), max(tally[d])))
+                votes[b] = (domain, max(tally[domain]))
+            else:
+                votes[b] = (None, None)
+
+        now = time.time()
+        with self._lock:
+            entries = self._get(sorted(votes))
+            link_rows = []
+            for b, (domain, score) in votes.items():
+                e = entries.get(b) or BrandEntry(b, "", 0.0, 0, 0, [], now)
+                e.observations += 1
+                if domain:
+                    if domain == e.domain:
+                        e.agreeing += 1
+                    elif e.agreeing <= 1:  # a weakly held domain is replaced by the new winner
+                        e.domain, e.agreeing, e.scores = domain, 1, []
+                    else:
+                        e.agreeing -= 1
+                    if domain == e.domain:
+                        e.scores = (e.scores + [score])[-SCORE_HISTORY:]
+                        link_rows.extend(
+                            (asin, b, json.dumps(links), now)
+                            for asin, d, _, links in per_brand[b] if asin and links and d == domain
+                        )
+                e.confidence = _confidence(e.agreeing, e.observations, e.scores)
+                e.updated_at = now
+                entries[b] = e
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO brands(brand, domain, confidence, observations, agreeing, scores, updated_at)"
+                " VALUES (?,?,?,?,?,?,?)",
+                [(e.brand, e.domain, e.confidence, e.observations, e.agreeing, json.dumps(e.scores), e.updated_at)
+                 for e in entries.values()],
+            )
+            if link_rows:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO asin_links(asin, brand, links, updated_at) VALUES (?,?,?,?)", link_rows
+                )
+            self._conn.commit()
+        return len(votes)
+
+_indexes: StoreRegistry[BrandDomainIndex] = StoreRegistry(BrandDomainIndex)
+
+def get_brand_index(cfg: AppConfig) -> Optional[BrandDomainIndex]:
+    """Index at cfg.BRAND_INDEX_PATH, or None with BRAND_INDEX_ENABLED off."""
+    return _indexes.get(cfg.BRAND_INDEX_PATH) if cfg.BRAND_INDEX_ENABLED else None
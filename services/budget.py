@@ -0,0 +1,115 @@
+# services/budget.py
+from __future__ import annotations
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional, Set
+import pandas as pd
+from services.query_planner import normalize_query
+from services.semantic import build_query
+from utils.data_ops import clean_text
+from utils.sqlite_store import SQLiteStore, StoreRegistry
+
+log = logging.getLogger(__name__)
+
+try:  # CSE quotas reset at midnight Pacific time
+    from zoneinfo import ZoneInfo
+    QUOTA_TZ = ZoneInfo("America/Los_Angeles")
+except Exception:  # pragma: no cover - no tz database available
+    QUOTA_TZ = None
+
+def quota_day(now: Optional[datetime] = None) -> str:
+    return (now or datetime.now(QUOTA_TZ)).strftime("%Y-%m-%d")
+
+class QuotaExceeded(RuntimeError):
+    """The daily CSE query budget is spent."""
+
+class UsageLedger(SQLiteStore):
+    """
+    Persistent per-day count of CSE queries, shared by every process using the same file.
+    reserve() checks and increments in one statement, so concurrent workers cannot overspend.
+    """
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS usage (day TEXT PRIMARY KEY, used INTEGER NOT NULL)",)
+
+    def used(self, day: Optional[str] = None) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT used FROM usage WHERE day=?", (day or quota_day(),)).fetchone()
+        return int(row[0]) if row else 0
+
+    def reserve(self, budget: int, n: int = 1) -> bool:
+        """Count `n` queries for today if that stays within `budget` (<= 0 means unlimited)."""
+        day = quota_day()
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO usage(day, used) VALUES (?, 0)", (day,))
+            if budget > 0:
+                cur = self._conn.execute("UPDATE usage SET used = used + ? WHERE day=? AND used + ? <= ?", (n, day, n, budget))
+            else:
+                cur = self._conn.execute("UPDATE usage SET used = used + ? WHERE day=?", (n, day))
+            self._conn.commit()
+            return cur.rowcount > 0
+
+    def refund(self, n: int = 1) -> None:
+        """Give back `n` reserved queries that were never answered (e.g. the request failed)."""
+        with self._lock:
+            self._conn.execute("UPDATE usage SET used = MAX(0, used - ?) WHERE day=?", (n, quota_day()))
+            self._conn.commit()
+
+_ledgers: StoreRegistry[UsageLedger] = StoreRegistry(UsageLedger)
+
+def get_usage_ledger(path: str) -> UsageLedger:
+    return _ledgers.get(path)
+
+def value_order(df: pd.DataFrame) -> List[int]:
+    """Row positions by expected value: highest sales_volume_num first (missing last), then best rank."""
+    keys = pd.DataFrame({
+        "sales": pd.to_numeric(df["sales_volume_num"], errors="coerce") if "sales_volume_num" in df else float("nan"),
+        "rank": pd.to_numeric(df["rank"], errors="coerce") if "rank" in df else float("nan"),
+        "pos": range(len(df)),
+    }, index=range(len(df)))
+    keys = keys.sort_values(["sales", "rank", "pos"], ascending=[False, True, True], na_position="last", kind="mergesort")
+    return keys["pos"].tolist()
+
+@dataclass
+class BudgetPlan:
+    """Row keys Stage 3 may search today, and the ones deferred to the next quota window."""
+    allowed: Set[str] = field(default_factory=set)
+    deferred: Set[str] = field(default_factory=set)
+    queries: int = 0       # first-page queries the allowed rows need (after coalescing)
+    remaining: Optional[int] = None
+
+def plan_budget(
+    df: pd.DataFrame,
+    keys: List[str],
+    remaining: Optional[int],
+    free: Iterable[str] = (),
+    is_cached: Optional[Callable[[str], bool]] = None,
+) -> BudgetPlan:
+    """
+    Spend `remaining` queries (None = unlimited) on the most valuable rows first. A row costs one
+    query unless its normalized query is already planned or `is_cached(query)` says the response
+    cache will answer it; rows in `free` (resumed, answered from the brand index) cost nothing.
+    `keys[n]` is the row key of `df.iloc[n]`.
+    """
+    plan = BudgetPlan(remaining=remaining)
+    free = set(free)
+    planned: Set[str] = set()
+    for pos in value_order(df):
+        key = keys[pos]
+        if key in free:
+            plan.allowed.add(key)
+            continue
+        row = df.iloc[pos]
+        brand, title = clean_text(row.get("brand")), clean_text(row.get("product_title"))
+        query = build_query(brand, title)
+        q = normalize_query(query)
+        cost = 0 if (q in planned or not (brand or title) or (is_cached and is_cached(query))) else 1
+        if remaining is not None and plan.queries + cost > remaining:
+            plan.deferred.add(key)
+            continue
+        plan.queries += cost
+        planned.add(q)
+        plan.allowed.add(key)
+    if plan.deferred:
+        log.info("CSE budget: %d queries left today; %d rows planned, %d deferred",
+                 remaining, len(plan.allowed), len(plan.deferred))
+    return plan
@@ -0,0 +1,71 @@
+# services/checkpoints.py
+from __future__ import annotations
+import io, json, logging, time
+from typing import Any, Dict, List, Optional
+import pandas as pd
+from utils.sqlite_store import SQLiteStore
+
+log = logging.getLogger(__name__)
+
+class CheckpointStore(SQLiteStore):
+    """
+    SQLite store of pipeline progress, so a restarted run resumes instead of re-spending quota.
+    - stages:      (category, stage) -> JSON payload ("stage1" rows, "stage2" table, "stage3" summary)
+    - stage3_rows: (category, row key) -> links found for that row
+    Safe to share between worker processes (each opens its own connection; WAL mode).
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS stages ("
+        " category TEXT, stage TEXT, payload TEXT, updated_at REAL, PRIMARY KEY (category, stage))",
+        "CREATE TABLE IF NOT EXISTS stage3_rows ("
+        " category TEXT, row_key TEXT, links TEXT, updated_at REAL, PRIMARY KEY (category, row_key))",
+    )
+
+    def get_stage(self, category: str, stage: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM stages WHERE category=? AND stage=?", (category, stage)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_stage(self, category: str, stage: str, payload: Any) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stages(category, stage, payload, updated_at) VALUES (?,?,?,?)",
+                (category, stage, json.dumps(payload), time.time()),
+            )
+            self._conn.commit()
+
+    def get_frame(self, category: str, stage: str) -> Optional[pd.DataFrame]:
+        raw = self.get_stage(category, stage)
+        return pd.read_json(io.StringIO(raw), orient="split", dtype=False) if raw is not None else None
+
+    def put_frame(self, category: str, stage: str, df: pd.DataFrame) -> None:
+        self.put_stage(category, stage, df.to_json(orient="split", index=False))
+
+    def get_rows(self, category: str) -> Dict[str, List[Optional[str]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_key, links FROM stage3_rows WHERE category=?", (category,)
+            ).fetchall()
+        return {k: json.loads(v) for k, v in rows}
+
+    def put_rows(self, category: str, rows: Dict[str, List[Optional[str]]]) -> None:
+        if not rows: return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO stage3_rows(category, row_key, links, updated_at) VALUES (?,?,?,?)",
+                [(category, k, json.dumps(v), now) for k, v in rows.items()],
+            )
+            self._conn.commit()
+
+    def clear(self, category: Optional[str] = None) -> None:
+        with self._lock:
+            if category is None:
+                self._conn.execute("DELETE FROM stages")
+                self._conn.execute("DELETE FROM stage3_rows")
+            else:
+                self._conn.execute("DELETE FROM stages WHERE category=?", (category,))
+                self._conn.execute("DELETE FROM stage3_rows WHERE category=?", (category,))
+            self._conn.commit()
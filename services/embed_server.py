@@ -0,0 +1,279 @@
+# services/embed_server.py
+"""
+Local embedding service shared by every Streamlit process on a host.
+
+One process holds the model and listens on a Unix socket; requests arriving from many sessions
+within a short window are encoded together in one micro-batch. Vectors travel as raw float32
+bytes: the server sends the array's buffer as is and the client receives straight into a
+preallocated NumPy array (no pickling, no intermediate copies).
+
+Wire format (little-endian, one request/response pair at a time per connection):
+  request:  b"EMB2" | n: u32 | id length: u16 | model id (UTF-8) | n x text length: u32 |
+            UTF-8 texts, concatenated
+  response: b"EMB2" | status: u32 | n: u32 | dim: u32 | n*dim float32
+            (status 0 = ok; otherwise dim is the length of a UTF-8 error message that follows
+            instead: 1 = encoding failed, 2 = the server runs a different model/backend)
+
+The model id names the model and backend the client's embedding cache is keyed by (see
+`services.semantic.model_id`); the server refuses requests for any other id, so vectors from
+one backend never land in another backend's cache. A request with n = 0 is a readiness probe.
+
+Run with:  python -m services.embed_server --socket /tmp/amazon_finder_embed.sock
+and set EMBED_SERVER_SOCKET to the same path in the app's environment.
+"""
+from __future__ import annotations
+import argparse, errno, logging, os, queue, socket, socketserver, struct, threading, time
+from concurrent.futures import Future
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"EMB2"
+_REQ_HEAD = struct.Struct("<4sIH")
+_RESP_HEAD = struct.Struct("<4sIII")
+MAX_TEXTS = 65536
+MAX_TEXT_BYTES = 64 * 1024 * 1024
+STATUS_OK, STATUS_ERROR, STATUS_WRONG_MODEL = 0, 1, 2
+
+class EmbedServerError(RuntimeError):
+    """The embedding server answered with an error."""
+
+def _recv_into(sock: socket.socket, buf: memoryview) -> None:
+    got = 0
+    while got < len(buf):
+        n = sock.recv_into(buf[got:])
+        if n == 0:
+            raise ConnectionError("embedding server connection closed")
+        got += n
+
+def _recv_exact(sock: socket.socket, n: int) -> bytearray:
+    buf = bytearray(n)
+    _recv_into(sock, memoryview(buf))
+    return buf
+
+def _pack_request(model_id: str, texts: Sequence[str]) -> Tuple[bytes, bytes]:
+    ident = model_id.encode("utf-8")
+    blobs = [t.encode("utf-8") for t in texts]
+    lens = np.fromiter((len(b) for b in blobs), dtype="<u4", count=len(blobs))
+    return _REQ_HEAD.pack(MAGIC, len(blobs), len(ident)) + ident + lens.tobytes(), b"".join(blobs)
+
+def _read_response(sock: socket.socket, n_texts: int) -> np.ndarray:
+    magic, status, n, dim = _RESP_HEAD.unpack(_recv_exact(sock, _RESP_HEAD.size))
+    if magic != MAGIC or n != n_texts:
+        raise ConnectionError("unexpected response from embedding server")
+    if status != STATUS_OK:
+        raise EmbedServerError(_recv_exact(sock, dim).decode("utf-8", "replace"))
+    out = np.empty((n, dim), dtype="<f4")
+    if out.size:
+        _recv_into(sock, memoryview(out).cast("B"))
+    return out.astype(np.float32, copy=False)
+
+# -------------------------
+# Server
+# -------------------------
+class MicroBatcher:
+    """Collects encode requests for up to `window_s` (or `max_batch` texts) and encodes them in one call."""
+    def __init__(self, encode, window_s: float = 0.005, max_batch: int = 256):
+        self._encode = encode
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self._q: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> "Future[np.ndarray]":
+        fut: Future = Future()
+        self._q.put((texts, fut))
+        return fut
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._q.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.window_s
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0: break
+                try:
+                    item = self._q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            texts = [t for req, _ in batch for t in req]
+            try:
+                vecs = self._encode(texts)
+            except Exception as e:
+                log.exception("Embedding batch of %d texts failed", len(texts))
+                for _, fut in batch: fut.set_exception(e)
+                continue
+            log.debug("Encoded %d texts from %d requests", len(texts), len(batch))
+            start = 0
+            for req, fut in batch:
+                fut.set_result(vecs[start:start + len(req)])
+                start += len(req)
+
+class _Handler(socketserver.BaseRequestHandler):
+    def _error(self, status: int, n: int, message: str) -> None:
+        msg = message.encode("utf-8")
+        self.request.sendall(_RESP_HEAD.pack(MAGIC, status, n, len(msg)) + msg)
+
+    def handle(self) -> None:
+        sock: socket.socket = self.request
+        batcher: MicroBatcher = self.server.batcher  # type: ignore[attr-defined]
+        served: str = self.server.model_id  # type: ignore[attr-defined]
+        while True:
+            try:
+                magic, n, id_len = _REQ_HEAD.unpack(_recv_exact(sock, _REQ_HEAD.size))
+            except ConnectionError:
+                return  # client went away between requests
+            if magic != MAGIC or n > MAX_TEXTS:
+                return
+            wanted = _recv_exact(sock, id_len).decode("utf-8", "replace")
+            lens = np.frombuffer(_recv_exact(sock, 4 * n), dtype="<u4")
+            total = int(lens.sum())
+            if total > MAX_TEXT_BYTES:
+                return
+            blob = bytes(_recv_exact(sock, total))
+            ends = np.cumsum(lens).tolist()
+            texts = [blob[a:b].decode("utf-8") for a, b in zip([0] + ends[:-1], ends)]
+            if wanted != served:
+                self._error(STATUS_WRONG_MODEL, n, f"server encodes with {served}, not {wanted}")
+                continue
+            try:
+                vecs = np.ascontiguousarray(batcher.submit(texts).result(), dtype="<f4") if texts else np.zeros((0, 0), "<f4")
+            except Exception as e:
+                self._error(STATUS_ERROR, n, str(e))
+                continue
+            dim = vecs.shape[1] if vecs.ndim == 2 else 0
+            sock.sendall(_RESP_HEAD.pack(MAGIC, STATUS_OK, n, dim))
+            if vecs.size:
+                sock.sendall(memoryview(vecs).cast("B"))
+
+def _remove_stale_socket(path: str) -> None:
+    """Remove a socket file left by a dead server; refuse to take over one a live server is listening on."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.remove(path)  # nobody listening: stale socket from a previous run
+        return
+    except FileNotFoundError:
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, f"an embedding server is already listening on {path}")
+
+class EmbedServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, encode, model_id: str, window_s: float = 0.005, max_batch: int = 256):
+        if os.path.exists(path):
+            _remove_stale_socket(path)
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o660)
+        self.path = path
+        self.model_id = model_id
+        self.batcher = MicroBatcher(encode, window_s, max_batch)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# -------------------------
+# Client
+# -------------------------
+class EmbedClient:
+    """Blocking client with one persistent connection per thread."""
+    def __init__(self, path: str, timeout: float = 60.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _sock(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._local.sock = sock
+        return sock
+
+    def close(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            self._local.sock = None
+            sock.close()
+
+    def encode(self, texts: Sequence[str], model_id: str) -> np.ndarray:
+        """
+        L2-normalized float32 vectors, one row per text. Raises EmbedServerError when the
+        server does not run `model_id`.
+        """
+        head, blob = _pack_request(model_id, texts)
+        sock = self._sock()
+        try:
+            sock.sendall(head)
+            sock.sendall(blob)
+            return _read_response(sock, len(texts))
+        except (OSError, ConnectionError):
+            self.close()  # the connection state is unknown now; reconnect next time
+            raise
+
+    def ping(self, model_id: str, timeout: float = 1.0) -> bool:
+        """Whether a server is answering on the socket and runs `model_id` (own short-lived connection)."""
+        head, _ = _pack_request(model_id, [])
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(self.path)
+                sock.sendall(head)
+                _read_response(sock, 0)
+            return True
+        except (OSError, EmbedServerError):
+            return False
+
+_clients: Dict[str, EmbedClient] = {}
+_clients_lock = threading.Lock()
+
+def get_embed_client(path: str) -> EmbedClient:
+    with _clients_lock:
+        client = _clients.get(path)
+        if client is None:
+            client = _clients[path] = EmbedClient(path)
+        return client
+
+def main() -> None:
+    from config.settings import AppConfig
+    from services.semantic import _encode, get_semantic_model, model_id
+    from utils.logging_setup import setup_logging
+
+    cfg = AppConfig()
+    p = argparse.ArgumentParser(description="Serve sentence embeddings to local app processes over a Unix socket.")
+    p.add_argument("--socket", default=cfg.EMBED_SERVER_SOCKET or "/tmp/amazon_finder_embed.sock")
+    p.add_argument("--backend", default=cfg.SEMANTIC_BACKEND, help="Requests from clients with another SEMANTIC_BACKEND are refused")
+    p.add_argument("--window-ms", type=float, default=cfg.EMBED_SERVER_WINDOW_MS)
+    p.add_argument("--max-batch", type=int, default=cfg.EMBED_SERVER_MAX_BATCH)
+    args = p.parse_args()
+    setup_logging(logging.INFO)
+
+    model = get_semantic_model(args.backend)
+    server = EmbedServer(
+        args.socket,
+        lambda texts: _encode(model, texts, batch_size=cfg.SEMANTIC_BATCH_SIZE),
+        model_id(args.backend),
+        window_s=args.window_ms / 1000.0,
+        max_batch=args.max_batch,
+    )
+    log.info("Embedding server (backend=%s) listening on %s", args.backend, args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,215 @@
 # services/google_client.py
 from __future__ import annotations
-import logging, time, requests
+import logging, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any, Optional, Sequence, Tuple
 from config.settings import AppConfig
+from services.budget import QuotaExceeded, UsageLedger, get_usage_ledger
+from services.http_client import HostPolicy, get_with_retry
+from services.query_planner import SingleFlight, normalize_query, plan_queries
+from services.response_cache import get_response_cache, make_cache_key
+from utils.metrics import instrumented, metrics
 
 log = logging.getLogger(__name__)
 
+GOOGLE_MAX_QPS = 10.0  # hard CSE limit
+
+# Searches currently running, shared by concurrent callers asking for the same normalized query
+_inflight = SingleFlight()
+
+class TokenBucket:
+    """Thread-safe token bucket. Each acquire() reserves a slot, so concurrent callers are spaced at exactly 1/rate."""
+    def __init__(self, rate: float = 8.0, capacity: float = 1.0):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self.rate = float(rate)
+
+    def acquire(self) -> float:
+        """Block until a token is available; returns the time waited (seconds)."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+            self._ts = now
+            self._tokens -= 1.0
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+# One bucket per CSE endpoint/engine (search_scope()), shared by every client in this process
+_buckets: Dict[Tuple[str, ...], TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+def get_token_bucket(scope: Tuple[str, ...]) -> TokenBucket:
+    with _buckets_lock:
+        bucket = _buckets.get(scope)
+        if bucket is None:
+            bucket = _buckets[scope] = TokenBucket()
+        return bucket
+
 @dataclass
 class GoogleUsage:
     requests_made: int = 0
+    pending: int = 0  # reserved queries still in flight (no ledger)
+    queries_coalesced: int = 0  # searches answered by another row's identical query
     last_call_ts: float = 0.0
     qps_target: float = 8.0
+    daily_budget: int = 0  # CSE queries per quota day; 0 = unlimited
+    ledger: Optional[UsageLedger] = field(default=None, repr=False)  # persists usage across runs/processes
+    bucket: Optional[TokenBucket] = field(default=None, repr=False)  # set by the client to its scope's shared bucket
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def used_today(self) -> int:
+        return self.ledger.used() if self.ledger else self.requests_made
+
+    def remaining_today(self) -> Optional[int]:
+        """Queries left in today's budget, or None when there is no budget."""
+        if self.daily_budget <= 0: return None
+        return max(0, self.daily_budget - self.used_today())
+
+    def reserve(self) -> None:
+        """Count one query against the daily budget right before sending it; raises QuotaExceeded when spent."""
+        if self.ledger:
+            ok = self.ledger.reserve(self.daily_budget)
+        else:
+            with self._lock:
+                # Count in-flight queries too, or concurrent searches could all pass the check
+                ok = self.daily_budget <= 0 or self.requests_made + self.pending < self.daily_budget
+                if ok: self.pending += 1
+        if not ok:
+            raise QuotaExceeded(f"daily CSE budget of {self.daily_budget} queries is spent")
+
+    def refund(self) -> None:
+        """Undo reserve() for a query that got no answer."""
+        if self.ledger:
+            self.ledger.refund()
+        else:
+            with self._lock:
+                self.pending = max(0, self.pending - 1)
 
     def wait_for_qps(self) -> None:
         if self.qps_target <= 0: return
-        now = time.time()
-        min_interval = max(0.125, 1.0 / float(self.qps_target))
-        delta = now - self.last_call_ts
-        if delta < min_interval:
-            time.sleep(min_interval - delta)
+        bucket = self.bucket or get_token_bucket(())
+        bucket.set_rate(min(GOOGLE_MAX_QPS, float(self.qps_target)))
+        with metrics.span("qps_wait", "stage3"):
+            bucket.acquire()
         self.last_call_ts = time.time()
 
+    def record_request(self) -> None:
+        """Count an answered query (its reservation, if any, is no longer pending)."""
+        with self._lock:
+            self.requests_made += 1
+            if not self.ledger: self.pending = max(0, self.pending - 1)
+
+    def record_coalesced(self, n: int) -> None:
+        with self._lock:
+            self.queries_coalesced += int(n)
+
 class GoogleClient:
     """Interface-like base. Concrete: SimulatedGoogleClient | RealGoogleClient"""
-    def search(self, query: str, exclude_domains: List[str], num: int = 10) -> Dict[str, Any]:
+    def search_scope(self) -> Tuple[str, ...]:
+        """What, besides the query itself, decides a search's response (clients sharing it share searches)."""
+        return (type(self).__name__,)
+
+    def search(self, query: str, exclude_domains: List[str], num: int = 10, start: int = 1) -> Dict[str, Any]:
         raise NotImplementedError
 
+    def is_cached(self, query: str, exclude_domains: Optional[List[str]] = None, num: int = 10, start: int = 1) -> bool:
+        """Whether `search` would answer from the response cache without spending a query."""
+        return False
+
+    def search_many(
+        self,
+        queries: Sequence[str],
+        exclude_domains: Optional[List[str]] = None,
+        num: int = 10,
+        max_workers: int = 8,
+        progress: Optional[Callable[[int, int], None]] = None,
+        start: int = 1,
+    ) -> List[Dict[str, Any]]:
+        """
+        Run many searches concurrently (rate limited by the shared token bucket) and return
+        payloads in the same order as `queries`. A failed search yields {"items": [], "error": ...},
+        with "deferred": True when it was refused by the daily budget; one answered from the
+        response cache carries "cached": True.
+        `progress(done, total)` is called from the calling thread. `start` is the 1-based index of
+        the first result (11, 21, ... for later pages).
+
+        Queries that normalize to the same text (case, punctuation, size/color variants) are
+        sent once and their payload is shared by every position; a search already in flight
+        for the same query from another thread is joined instead of repeated.
+        """
+        plan = plan_queries(queries)
+        total = len(plan.queries)
+        out: List[Dict[str, Any]] = [{"items": []} for _ in range(total)]
+        if not total: return out
+        if plan.coalesced:
+            log.info("GoogleCSE: %d queries coalesced into %d searches", len(queries), total)
+            usage = getattr(self, "usage", None)
+            if usage is not None: usage.record_coalesced(plan.coalesced)
+        excl = list(exclude_domains or [])
+        with ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="cse") as pool:
+            futures = {
+                pool.submit(self.search_shared, q, key, excl, num, start): n
+                for n, (q, key) in enumerate(zip(plan.queries, plan.keys))
+            }
+            for done, fut in enumerate(as_completed(futures), start=1):
+                n = futures[fut]
+                try:
+                    out[n] = fut.result()
+                except QuotaExceeded as e:
+                    out[n] = {"items": [], "error": str(e), "deferred": True}
+                except Exception as e:
+                    log.warning("Google search failed for query %d: %s", n, e)
+                    out[n] = {"items": [], "error": str(e)}
+                if progress: progress(done, total)
+        return plan.fan_out(out)
+
+    def search_shared(
+        self,
+        query: str,
+        key: Optional[str] = None,
+        exclude_domains: Optional[List[str]] = None,
+        num: int = 10,
+        start: int = 1,
+    ) -> Dict[str, Any]:
+        """
+        `search`, joining an identical search already in flight from any client in this process
+        (same endpoint/engine, normalized query, exclusions, num and start).
+        """
+        excl = list(exclude_domains or [])
+        flight_key = (self.search_scope(), key if key is not None else normalize_query(query), tuple(excl), num, start)
+        return _inflight.do(flight_key, lambda: self.search(query, excl, num, start))
+
 @dataclass
 class SimulatedGoogleClient(GoogleClient):
     usage: GoogleUsage = field(default_factory=GoogleUsage)
+    latency: float = 0.0     # seconds per call, to mimic network round trips offline
+    throttle: bool = False   # honor usage.qps_target like the real client
 
-    def search(self, query: str, exclude_domains: List[str], num: int = 10) -> Dict[str, Any]:
+    def __post_init__(self) -> None:
+        if self.usage.bucket is None:
+            self.usage.bucket = get_token_bucket(self.search_scope())
+
+    @instrumented("google_search", "stage3")
+    def search(self, query: str, exclude_domains: List[str], num: int = 10, start: int = 1) -> Dict[str, Any]:
         # No external calls. Return deterministic “plausible” items.
-        self.usage.requests_made += 1
+        self.usage.reserve()
+        if self.throttle:
+            self.usage.wait_for_qps()
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self.usage.record_request()
         base = query.strip() or "Unknown Product"
         items = []
-        for i in range(1, min(num, 10) + 1):
+        for i in range(start, start + min(num, 10)):
             items.append({
                 "title": f"{base} — Reference {i}",
                 "link": f"https://example.com/{base.replace(' ', '-').lower()}/{i}",
@@ -49,27 +222,68 @@ class RealGoogleClient(GoogleClient):
     cfg: AppConfig
     usage: GoogleUsage = field(default_factory=GoogleUsage)
 
-    def search(self, query: str, exclude_domains: List[str], num: int = 10) -> Dict[str, Any]:
-        if not self.cfg.GOOGLE_API_KEY or not self.cfg.GOOGLE_CSE_CX:
-            raise RuntimeError("Missing GOOGLE_API_KEY or GOOGLE_CSE_CX.")
+    def search_scope(self) -> Tuple[str, ...]:
+        return (type(self).__name__, self.cfg.GOOGLE_URL, self.cfg.GOOGLE_CSE_CX)
+
+    def __post_init__(self) -> None:
         self.usage.qps_target = self.cfg.GOOGLE_QPS_TARGET
-        self.usage.wait_for_qps()
+        self.usage.daily_budget = self.cfg.GOOGLE_DAILY_BUDGET
+        if self.usage.bucket is None:  # every session searching this engine draws from one bucket
+            self.usage.bucket = get_token_bucket(self.search_scope())
+        # Queries only count against the shared ledger when there is a budget to enforce
+        if self.usage.ledger is None and self.cfg.GOOGLE_USAGE_PATH and self.usage.daily_budget > 0:
+            self.usage.ledger = get_usage_ledger(self.cfg.GOOGLE_USAGE_PATH)
 
+    def _params(self, query: str, exclude_domains: Optional[List[str]], num: int, start: int) -> Dict[str, Any]:
         excl = " ".join(f"-site:{d}" for d in exclude_domains) if exclude_domains else ""
-        q = f"{query} {excl}".strip()
-        params = {
+        return {
             "key": self.cfg.GOOGLE_API_KEY,
             "cx": self.cfg.GOOGLE_CSE_CX,
-            "q": q,
+            "q": f"{query} {excl}".strip(),
             "num": min(max(num, 1), 10),
-            "start": 1,
+            "start": max(1, int(start)),
         }
+
+    def is_cached(self, query: str, exclude_domains: Optional[List[str]] = None, num: int = 10, start: int = 1) -> bool:
+        cache = get_response_cache(self.cfg)
+        if not cache: return False
+        key = make_cache_key(self.cfg.GOOGLE_URL, self._params(query, exclude_domains, num, start))
+        return cache.contains(key, self.cfg.CACHE_TTL_GOOGLE_S)
+
+    @instrumented("google_search", "stage3")
+    def search(self, query: str, exclude_domains: List[str], num: int = 10, start: int = 1) -> Dict[str, Any]:
+        if not self.cfg.GOOGLE_API_KEY or not self.cfg.GOOGLE_CSE_CX:
+            raise RuntimeError("Missing GOOGLE_API_KEY or GOOGLE_CSE_CX.")
+
+        params = self._params(query, exclude_domains, num, start)
+        q = params["q"]
         url = self.cfg.GOOGLE_URL
-        log.info("GoogleCSE: GET %s q='%s'", url, q)
-        resp = requests.get(url, params=params, timeout=30)
-        resp.raise_for_status()
-        self.usage.requests_made += 1
-        return resp.json()
+        cache = get_response_cache(self.cfg)
+        key = make_cache_key(url, params)
+        if cache:
+            cached = cache.get(key, self.cfg.CACHE_TTL_GOOGLE_S)
+            metrics.current().cache = "miss" if cached is None else "hit"
+            if cached is not None:
+                log.info("GoogleCSE: cache hit q='%s' start=%s", q, params["start"])
+                cached["cached"] = True  # replayed, not new evidence (see BrandDomainIndex.observe)
+                return cached
+
+        self.usage.reserve()
+        try:
+            log.info("GoogleCSE: GET %s q='%s' start=%s", url, q, params["start"])
+            resp = get_with_retry(
+                url, params=params, timeout=30,
+                max_retries=self.cfg.HTTP_MAX_RETRIES, backoff=self.cfg.HTTP_BACKOFF_S,
+                policy=HostPolicy.from_config(self.cfg),
+                before_attempt=self.usage.wait_for_qps,  # every attempt counts against the CSE QPS limit
+            )
+        except Exception:
+            self.usage.refund()  # open breaker or failed request: nothing was answered
+            raise
+        self.usage.record_request()
+        payload = resp.json()
+        if cache: cache.put(key, "google-cse", payload)
+        return payload
 
 def make_google_client(cfg: AppConfig) -> GoogleClient:
     return SimulatedGoogleClient() if cfg.GOOGLE_MODE == "simulate" else RealGoogleClient(cfg)
@@ -0,0 +1,277 @@
+# services/http_client.py
+from __future__ import annotations
+import email.utils, logging, random, threading, time, requests
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from utils.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_STATUSES = {429, 503}  # upstream asking us to slow down
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised without calling out while a host's circuit breaker is open."""
+
+@dataclass(frozen=True)
+class HostPolicy:
+    """Per-host limits for the adaptive concurrency limiter and circuit breaker."""
+    max_concurrency: int = 8
+    min_concurrency: int = 1
+    latency_tolerance: float = 2.0   # shrink when latency exceeds this multiple of the baseline
+    latency_decay: float = 0.05      # how fast the baseline rises toward slower latencies (EWMA weight)
+    breaker_failures: int = 5        # consecutive failures that open the breaker
+    breaker_cooldown_s: float = 30.0 # open time before a single trial request is let through
+    max_backoff_s: float = 30.0
+
+    @classmethod
+    def from_config(cls, cfg: Any) -> "HostPolicy":
+        return cls(
+            max_concurrency=cfg.HTTP_MAX_CONCURRENCY,
+            breaker_failures=cfg.HTTP_BREAKER_FAILURES,
+            breaker_cooldown_s=cfg.HTTP_BREAKER_COOLDOWN_S,
+        )
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: +1/limit per successful call (about +1 per round trip of the whole
+    window), halved on a throttling response or when latency exceeds `latency_tolerance` times
+    the baseline latency. The baseline follows faster samples at once and slower ones as an EWMA
+    (`latency_decay`), so one lucky fast response does not mark every later call as slow after
+    the upstream's normal latency shifts. At most one decrease per observed round trip, so one
+    burst of 429s does not collapse the limit to the floor.
+    """
+    def __init__(self, policy: HostPolicy, name: str = ""):
+        self.policy = policy
+        self.name = name
+        self.limit = float(max(policy.min_concurrency, min(policy.max_concurrency, 2)))
+        self.in_flight = 0
+        self._baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency: Optional[float], throttled: bool = False) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            base = self._baseline
+            slow = (latency is not None and base is not None
+                    and latency > self.policy.latency_tolerance * max(base, 0.05))
+            if latency is not None and not throttled:
+                if base is None or latency < base:
+                    self._baseline = latency
+                else:
+                    self._baseline = base + self.policy.latency_decay * (latency - base)
+            if throttled or slow:
+                if now - self._last_decrease >= (latency or base or 1.0):
+                    self._last_decrease = now
+                    old = self.limit
+                    self.limit = max(float(self.policy.min_concurrency), self.limit / 2)
+                    log.info("HTTP %s: concurrency %.1f -> %.1f (%s)", self.name, old, self.limit,
+                             "throttled" if throttled else f"latency {latency:.2f}s")
+            elif latency is not None:
+                self.limit = min(float(self.policy.max_concurrency), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator[Dict[str, Any]]:
+        """Hold one concurrency slot; the caller fills outcome["latency"] / outcome["throttled"]."""
+        self.acquire()
+        outcome: Dict[str, Any] = {"latency": None, "throttled": False}
+        try:
+            yield outcome
+        finally:
+            self.release(outcome["latency"], outcome["throttled"])
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open (one trial call) after the cooldown."""
+    def __init__(self, policy: HostPolicy, name: str = ""):
+        self.policy = policy
+        self.name = name
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.policy.breaker_cooldown_s else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None: return True
+            if time.monotonic() - self.opened_at < self.policy.breaker_cooldown_s or self._trial:
+                return False
+            self._trial = True  # half-open: let exactly one request probe the host
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                log.info("HTTP %s: circuit closed", self.name)
+            self.failures, self.opened_at, self._trial = 0, None, False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and self.failures >= self.policy.breaker_failures):
+                log.warning("HTTP %s: circuit open for %.0fs after %d failures", self.name, self.policy.breaker_cooldown_s, self.failures)
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def release_trial(self) -> None:
+        """Give back a half-open trial slot whose call ended without an outcome (e.g. interrupted)."""
+        with self._lock:
+            self._trial = False
+
+@dataclass
+class HostState:
+    limiter: AdaptiveLimiter
+    breaker: CircuitBreaker
+
+_hosts: Dict[str, HostState] = {}
+_hosts_lock = threading.Lock()
+
+def get_host_state(host: str, policy: Optional[HostPolicy] = None) -> HostState:
+    """Process-wide limiter/breaker for `host`, created with `policy` on first use."""
+    with _hosts_lock:
+        state = _hosts.get(host)
+        if state is None:
+            policy = policy or HostPolicy()
+            state = _hosts[host] = HostState(AdaptiveLimiter(policy, host), CircuitBreaker(policy, host))
+        return state
+
+def host_stats() -> Dict[str, Dict[str, Any]]:
+    """Current concurrency limit and breaker state per host (for logs/metrics views)."""
+    with _hosts_lock:
+        items = list(_hosts.items())
+    return {
+        h: {"limit": round(st.limiter.limit, 2), "in_flight": st.limiter.in_flight,
+            "breaker": st.breaker.state, "failures": st.breaker.failures}
+        for h, st in items
+    }
+
+def backoff_delay(attempt: int, backoff: float, cap: float = 30.0) -> float:
+    """Exponential backoff with full jitter: uniform(0, min(cap, backoff * 2**attempt))."""
+    return random.uniform(0.0, min(cap, backoff * (2 ** attempt)))
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def get_session(pool_size: int = 16) -> requests.Session:
+    """Process-wide keep-alive session, so concurrent calls reuse TCP/TLS connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+        return _session
+
+def retry_after_seconds(resp: requests.Response) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP-date)."""
+    raw = resp.headers.get("Retry-After")
+    if not raw: return None
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(raw).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def get_with_retry(
+    url: str,
+    *,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: float = 60,
+    max_retries: int = 3,
+    backoff: float = 1.0,
+    session: Optional[requests.Session] = None,
+    policy: Optional[HostPolicy] = None,
+    before_attempt: Optional[Callable[[], Any]] = None,
+) -> requests.Response:
+    """
+    GET through the host's adaptive concurrency limiter and circuit breaker, with exponential
+    backoff (full jitter) on connection errors and retryable statuses (429/5xx). A Retry-After
+    header from the server takes precedence over the computed delay; one longer than the
+    policy's max_backoff_s fails the request straight away. While the host's breaker
+    is open this raises CircuitOpenError without calling out. `before_attempt` runs before every
+    attempt, retries included (e.g. to take a rate-limit token per request sent).
+    """
+    sess = session or get_session()
+    span = metrics.current()  # retries/bytes are attributed to the caller's span
+    host = urlsplit(url).netloc
+    state = get_host_state(host, policy)
+    cap = (policy or state.limiter.policy).max_backoff_s
+    for attempt in range(max_retries + 1):
+        last = attempt >= max_retries
+        if before_attempt: before_attempt()
+        if not state.breaker.allow():
+            raise CircuitOpenError(f"circuit open for {host}")
+        settled = False  # every exit must settle the breaker, or a half-open trial would never end
+        try:
+            with state.limiter.slot() as outcome:
+                t0 = time.perf_counter()
+                try:
+                    resp = sess.get(url, params=params, headers=headers, timeout=timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    outcome["throttled"] = True  # timeouts/resets usually mean an overloaded upstream
+                    state.breaker.record_failure()
+                    settled = True
+                    if last: raise
+                    resp, error = None, e
+                except requests.RequestException:
+                    # Broken body, bad encoding, redirect loops: the host is not healthy either
+                    state.breaker.record_failure()
+                    settled = True
+                    raise
+                else:
+                    outcome["latency"] = time.perf_counter() - t0
+                    outcome["throttled"] = resp.status_code in THROTTLE_STATUSES
+            if resp is not None:
+                if resp.status_code >= 500:
+                    state.breaker.record_failure()
+                else:
+                    state.breaker.record_success()
+                settled = True
+        finally:
+            if not settled:
+                state.breaker.release_trial()
+        # Sleeps happen outside the slot, so waiting callers do not hold concurrency
+        if resp is None:
+            delay = backoff_delay(attempt, backoff, cap)
+            log.warning("HTTP %s failed (attempt %d): %s; retrying in %.1fs", url, attempt + 1, error, delay)
+            if span: span.retries += 1
+            time.sleep(delay)
+            continue
+        if resp.status_code in RETRY_STATUSES and not last:
+            delay = retry_after_seconds(resp)
+            if delay is None:
+                delay = backoff_delay(attempt, backoff, cap)
+            elif delay > cap:
+                # Quota-style Retry-After (minutes/hours): fail now instead of parking the worker
+                log.warning("HTTP %s -> %d with Retry-After %.0fs (> %.0fs cap); giving up", url, resp.status_code, delay, cap)
+                resp.raise_for_status()
+            log.warning("HTTP %s -> %d (attempt %d); retrying in %.1fs", url, resp.status_code, attempt + 1, delay)
+            if span: span.retries += 1
+            time.sleep(delay)
+            continue
+        if span: span.bytes += len(resp.content or b"")
+        resp.raise_for_status()
+        return resp
+    raise RuntimeError("unreachable")  # pragma: no cover
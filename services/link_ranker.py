@@ -1,20 +1,125 @@
 # services/link_ranker.py
 from __future__ import annotations
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, Sequence, Tuple
 from urllib.parse import urlparse
 from thefuzz import fuzz  # fuzzy string matching
+from utils.metrics import instrumented
+
+try:  # thefuzz is built on rapidfuzz; its pairwise scorer lets us score all pairs in one call
+    from rapidfuzz import fuzz as _rf_fuzz
+    from rapidfuzz.process import cpdist as _cpdist
+except ImportError:  # pragma: no cover - older rapidfuzz / pure thefuzz
+    _cpdist = None
+
+# Multi-label public suffixes we meet in practice (subset of the Public Suffix List).
+# Anything else falls back to the last label (".com", ".de", ...).
+PUBLIC_SUFFIXES = frozenset("""
+co.uk org.uk me.uk ltd.uk plc.uk net.uk ac.uk gov.uk sch.uk nhs.uk
+com.au net.au org.au edu.au gov.au id.au asn.au
+co.nz net.nz org.nz govt.nz ac.nz
+co.jp ne.jp or.jp ac.jp go.jp
+co.kr or.kr ne.kr
+com.cn net.cn org.cn gov.cn edu.cn
+com.hk net.hk org.hk
+com.tw net.tw org.tw
+com.sg net.sg org.sg edu.sg
+com.my net.my org.my
+co.in net.in org.in firm.in gen.in ind.in
+co.id or.id web.id
+co.th in.th
+com.ph net.ph org.ph
+com.vn net.vn
+com.br net.br org.br
+com.mx org.mx gob.mx
+com.ar org.ar
+com.co net.co
+com.pe
+com.tr org.tr
+com.sa
+com.eg
+co.za org.za
+co.il org.il
+com.ua
+co.at or.at
+com.pl net.pl org.pl
+com.es org.es
+com.pt
+com.gr
+co.ke
+com.ng
+github.io herokuapp.com netlify.app vercel.app pages.dev blogspot.com myshopify.com
+""".split())
+
+@lru_cache(maxsize=65536)
+def registrable_domain(host: str) -> str:
+    """
+    eTLD+1 of a host using the embedded suffix table:
+    sub.amazon.co.uk -> amazon.co.uk, www.acme.com -> acme.com
+    """
+    host = host.lower().strip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    labels = host.split(".")
+    if len(labels) < 2:
+        return host
+    for n in range(len(labels) - 1, 0, -1):  # longest matching suffix wins
+        if ".".join(labels[-n:]) in PUBLIC_SUFFIXES:
+            return ".".join(labels[-(n + 1):]) if len(labels) > n else host
+    return ".".join(labels[-2:])
+
+@lru_cache(maxsize=65536)
+def _domain_part_of_host(host: str) -> str:
+    reg = registrable_domain(host)
+    return reg.split(".", 1)[0] if "." in reg else reg
 
 def _extract_domain_part(url: str) -> str:
-    """Get the domain string (without subdomain) from URL, e.g. amazon.com, sub.amazon.co.uk -> amazon"""
+    """Get the registrable label (without subdomain/suffix) from URL, e.g. amazon.com, sub.amazon.co.uk -> amazon"""
     netloc = urlparse(url).netloc.lower()
-    # strip www. if present
-    if netloc.startswith("www."):
-        netloc = netloc[4:]
-    # split by dots, take the “second-level domain” part (before first dot)
-    parts = netloc.split(".")
-    if len(parts) >= 2:
-        return parts[-2]  # e.g. for “sub.amazon.co.uk” parts = ["sub","amazon","co","uk"] → -2 is "co", wrong
-    return netloc
+    if ":" in netloc:
+        netloc = netloc.split(":", 1)[0]
+    return _domain_part_of_host(netloc)
+
+def _score_pairs(pairs: Sequence[Tuple[str, str]]) -> List[int]:
+    """fuzz.partial_ratio for each (brand, domain) pair; one vectorized call when rapidfuzz is available."""
+    if not pairs: return []
+    if _cpdist is not None:
+        import numpy as np
+        brands = [b for b, _ in pairs]
+        domains = [d for _, d in pairs]
+        raw = _cpdist(brands, domains, scorer=_rf_fuzz.partial_ratio, dtype=np.float64)
+        return [int(round(x)) for x in raw.tolist()]  # same rounding as thefuzz
+    return [fuzz.partial_ratio(b, d) for b, d in pairs]
+
+@instrumented("rank_links", "stage3")
+def rank_links_by_brand_batch(rows: Sequence[Tuple[List[Dict], str]], threshold: int = 70) -> List[List[Dict]]:
+    """
+    `rank_links_by_brand` for many rows at once: every distinct (brand, domain) pair across the
+    whole table is scored once, in a single call. Returns one ranked list per (links, brand) row.
+    """
+    parsed: List[List[Tuple[Dict, str]]] = []
+    index: Dict[Tuple[str, str], int] = {}
+    for links, brand in rows:
+        brand_norm = (brand or "").lower().strip()
+        row = []
+        for it in links:
+            url = it.get("url")
+            if not url:
+                continue
+            pair = (brand_norm, _extract_domain_part(url))
+            index.setdefault(pair, len(index))
+            row.append((it, pair))
+        parsed.append(row)
+
+    scores = _score_pairs(list(index.keys()))
+    out: List[List[Dict]] = []
+    for row in parsed:
+        scored = [{**it, "brand_domain_score": scores[index[pair]]} for it, pair in row]
+        # Filter those that pass threshold
+        passed = [it for it in scored if it["brand_domain_score"] >= threshold]
+        # Sort passed by descending score; if none pass, return all links sorted by score descending
+        out.append(sorted(passed or scored, key=lambda x: x["brand_domain_score"], reverse=True))
+    return out
 
 def rank_links_by_brand(links: List[Dict], brand: str, threshold: int = 70) -> List[Dict]:
     """
@@ -22,23 +127,4 @@ def rank_links_by_brand(links: List[Dict], brand: str, threshold: int = 70) -> L
     and the brand string. If similarity ≥ threshold, we keep only those links (or rank them highest).
     Returns filtered/ordered list.
     """
-    scored = []
-    brand_norm = brand.lower().strip()
-    for it in links:
-        url = it.get("url")
-        if not url:
-            continue
-        dom = _extract_domain_part(url)
-        # compute fuzzy ratio
-        score = fuzz.partial_ratio(brand_norm, dom)
-        scored.append({**it, "brand_domain_score": score})
-
-    # Filter those that pass threshold
-    passed = [it for it in scored if it["brand_domain_score"] >= threshold]
-    if passed:
-        # Sort passed by descending score
-        passed_sorted = sorted(passed, key=lambda x: x["brand_domain_score"], reverse=True)
-        return passed_sorted
-    else:
-        # If none pass, return original links sorted by score descending
-        return sorted(scored, key=lambda x: x["brand_domain_score"], reverse=True)
+    return rank_links_by_brand_batch([(links, brand)], threshold=threshold)[0]
@@ -0,0 +1,302 @@
+# services/pipeline.py
+from __future__ import annotations
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+import pandas as pd
+from config.settings import AppConfig
+from services.brand_index import BrandDomainIndex, get_brand_index, normalize_brand
+from services.budget import BudgetPlan, plan_budget
+from services.google_client import GoogleClient
+from services.link_ranker import rank_links_by_brand_batch
+from services.query_planner import normalize_query
+from services.semantic import build_query, semantic_filter_batch, get_embedding_cache
+from services.url_filter import DomainMatcher, get_excluded_domains, get_domain_matcher, filter_rows_by_domain
+from utils.data_ops import clean_text
+
+log = logging.getLogger(__name__)
+
+# progress(message, percent)
+ProgressFn = Callable[[str, int], None]
+# Links found for a row: [link_1, ..., link_N] (None where missing)
+RowLinks = List[Optional[str]]
+
+# Brand/domain similarity a link needs to be treated as the brand's own site
+BRAND_MATCH_THRESHOLD = 75
+
+# Google CSE returns at most 10 results per request and nothing beyond start=91
+CSE_PAGE_SIZE = 10
+CSE_MAX_START = 91
+
+def row_key(index: Any, row: Mapping[str, Any]) -> str:
+    """Stable identity of a Stage 3 row (ASIN when present), used for checkpoints."""
+    return clean_text(row.get("asin")) or f"row:{index}"
+
+def has_budget(client: GoogleClient) -> bool:
+    """Whether `client` spends a daily CSE budget (Stage 3 then marks rows it had to defer)."""
+    return getattr(getattr(client, "usage", None), "daily_budget", 0) > 0
+
+def link_columns(df: pd.DataFrame, max_links: int, deferred: bool = False) -> List[str]:
+    """Output columns of Stage 3: the input columns followed by link_1..link_N (and `deferred` when budgeted)."""
+    links = [f"link_{j+1}" for j in range(int(max_links))] + (["deferred"] if deferred else [])
+    return list(df.columns) + [c for c in links if c not in df.columns]
+
+def _plan_stage3_budget(
+    df: pd.DataFrame,
+    client: GoogleClient,
+    remaining: int,
+    done_rows: Optional[Mapping[str, RowLinks]],
+    brand_index: Optional[BrandDomainIndex],
+    matcher: DomainMatcher,
+    cfg: AppConfig,
+) -> BudgetPlan:
+    """
+    Budget plan for the whole table; resumed rows, rows the brand index can answer and rows whose
+    first result page is in the response cache are free.
+    """
+    keys = [row_key(i, row) for i, row in df.iterrows()]
+    free = {k for k in keys if done_rows and k in done_rows}
+    if brand_index and "brand" in df:
+        known = brand_index.lookup(df["brand"].dropna().astype(str), cfg.BRAND_INDEX_MIN_CONFIDENCE, cfg.BRAND_INDEX_TTL_S)
+        ok = {b for b, e in known.items() if not matcher.matches(e.domain)}
+        stored = brand_index.links_for(keys, cfg.BRAND_INDEX_TTL_S) if ok else {}
+        free.update(k for k, b in zip(keys, df["brand"]) if normalize_brand(clean_text(b)) in ok and stored.get(k))
+    return plan_budget(df, keys, remaining, free, is_cached=lambda q: client.is_cached(q, num=CSE_PAGE_SIZE))
+
+def iter_stage3(
+    df: pd.DataFrame,
+    client: GoogleClient,
+    cfg: AppConfig,
+    max_links: int,
+    threshold: float,
+    progress: Optional[ProgressFn] = None,
+    done_rows: Optional[Mapping[str, RowLinks]] = None,
+    on_rows: Optional[Callable[[Dict[str, RowLinks]], None]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    """
+    Stage 3 as a stream: Google search -> batched semantic filter -> domain exclusions ->
+    brand/domain ranking, over windows of cfg.STAGE3_CHUNK_ROWS rows. Each row gets up to
+    cfg.CSE_MAX_PAGES result pages (1 unless opted in), fetched only while it has fewer than
+    `max_links` links left after filtering. Yields (row index, record with link_1..link_N) in table order as soon as
+    each window finishes.
+
+    When the client has a daily CSE budget, it is spent on the most valuable rows first (by
+    sales_volume_num, then rank); every record then carries a `deferred` flag, and the rows the
+    budget did not cover are yielded with `deferred=True` and no links and are not reported to
+    `on_rows`, so a resumed run picks them up in the next quota window. Rows whose search failed
+    (open breaker, retries exhausted, offline cache miss) are yielded with whatever links they got
+    but are not reported to `on_rows` either; stats["rows_failed"] counts them.
+
+    Rows whose key is in `done_rows` are filled from it without any work; rows whose brand has a
+    confident entry in the brand->domain index and whose ASIN has official links stored there get
+    those links instead of a search. Only rows answered by a live search vote in the index.
+    `on_rows` receives {row key: links} for the rows computed in each window; `stats` (if given)
+    is filled in place.
+    """
+    max_links = int(max_links)
+    cache_before = get_embedding_cache().stats()
+    usage = getattr(client, "usage", None)
+    coalesced_before = getattr(usage, "queries_coalesced", 0)
+    excluded = get_excluded_domains()
+    log.info("Applying server-side domain exclusions: %d rules", len(excluded))
+    matcher = get_domain_matcher(excluded)
+    brand_index = get_brand_index(cfg)
+    remaining = usage.remaining_today() if hasattr(usage, "remaining_today") else None
+    budget = _plan_stage3_budget(df, client, remaining, done_rows, brand_index, matcher, cfg) if remaining is not None else None
+
+    total = len(df)
+    chunk_size = max(1, int(cfg.STAGE3_CHUNK_ROWS))
+    # Rows with the same normalized query share one search across the whole table (the scope the
+    # budget plan counts in): a page's payload is kept only while later windows still need it.
+    row_keys = [
+        normalize_query(build_query(clean_text(b), clean_text(t)))
+        for b, t in zip(df["brand"] if "brand" in df else [""] * total, df["product_title"] if "product_title" in df else [""] * total)
+    ]
+    later = Counter(row_keys)
+    carried: Dict[Tuple[str, int], Dict[str, Any]] = {}  # (normalized query, start) -> payload
+    resumed = from_index = 0
+    deferred: set = set()
+    failed: set = set()
+    observed: List[Tuple[str, Optional[str], List[Dict[str, Any]]]] = []  # brand index learns once per run
+    for start in range(0, total, chunk_size):
+        later.subtract(row_keys[start:start + chunk_size])
+        window: List[Tuple[Any, Dict[str, Any], RowLinks, str]] = []  # (index, record, links, key)
+        todo: List[Tuple[int, str, str, str, str]] = []  # (window pos, key, brand, target, query)
+        for i, row in df.iloc[start:start + chunk_size].iterrows():
+            key = row_key(i, row)
+            links: RowLinks = []
+            if done_rows and key in done_rows:
+                links = list(done_rows[key])
+                resumed += 1
+            elif budget and key in budget.deferred:
+                deferred.add(key)
+            else:
+                brand = clean_text(row.get("brand"))
+                title = clean_text(row.get("product_title"))
+                target = f"{brand} {title}".strip() or title or brand
+                if target:
+                    todo.append((len(window), key, brand, target, build_query(brand, title)))
+            window.append((i, row.to_dict(), links, key))
+
+        finished_rows: Dict[str, RowLinks] = {}
+        if todo and brand_index:
+            # Known brands: the ASIN's official links from a previous run; ASINs the index has no
+            # links for are still searched (their results then teach the index)
+            known = brand_index.lookup([t[2] for t in todo], cfg.BRAND_INDEX_MIN_CONFIDENCE, cfg.BRAND_INDEX_TTL_S)
+            if known:
+                seen_links = brand_index.links_for([t[1] for t in todo], cfg.BRAND_INDEX_TTL_S)
+                rest = []
+                for t in todo:
+                    entry = known.get(normalize_brand(t[2]))
+                    if entry is None or matcher.matches(entry.domain) or not seen_links.get(t[1]):
+                        rest.append(t)
+                        continue
+                    links = seen_links[t[1]][:max_links]
+                    window[t[0]][2].extend(links)
+                    finished_rows[t[1]] = links
+                from_index += len(todo) - len(rest)
+                todo = rest
+
+        if todo:
+            # Google searches, many in flight (rate limited by the client's token bucket);
+            # rows with the same normalized query share one search. Further result pages are
+            # requested only for rows still short of max_links passing links, up to the page budget.
+            def _search_progress(done: int, n: int) -> None:
+                if progress:
+                    finished = start + int(done / max(1, n) * len(window))
+                    progress(f"Stage 3: searching links ({finished}/{total}) …", min(95, int(5 + (finished / max(1, total)) * 90)))
+
+            domain_rows: List[List[Dict[str, Any]]] = [[] for _ in todo]
+            seen_urls: List[set] = [set() for _ in todo]
+            active = list(range(len(todo)))
+            live = [False] * len(todo)  # first page came from a live search, not the response cache
+            for page in range(max(1, int(cfg.CSE_MAX_PAGES))):
+                page_start = 1 + page * CSE_PAGE_SIZE
+                qkeys = [normalize_query(todo[n][4]) for n in active]
+                missing = [j for j, k in enumerate(qkeys) if (k, page_start) not in carried]
+                fetched = client.search_many(
+                    [todo[active[j]][4] for j in missing],
+                    exclude_domains=[],  # we filter after
+                    num=CSE_PAGE_SIZE,
+                    max_workers=cfg.GOOGLE_CONCURRENCY,
+                    progress=_search_progress if page == 0 else None,
+                    start=page_start,
+                )
+                payloads = [carried.get((k, page_start)) for k in qkeys]
+                for j, payload in zip(missing, fetched):
+                    payloads[j] = payload
+                    if later[qkeys[j]] > 0 and not payload.get("error"):
+                        carried[(qkeys[j], page_start)] = payload
+                if len(missing) < len(active) and usage is not None and hasattr(usage, "record_coalesced"):
+                    usage.record_coalesced(len(active) - len(missing))
+                if page == 0:
+                    for n, payload in zip(active, payloads):
+                        live[n] = not payload.get("cached") and not payload.get("error")
+                    # Searches refused because the budget ran out (e.g. spent by another worker)
+                    out_of_quota = {n for n, payload in zip(active, payloads) if payload.get("deferred")}
+                    deferred.update(todo[n][1] for n in out_of_quota)
+                # Searches that errored for any other reason: retried on the next run, never checkpointed
+                failed.update(todo[n][1] for n, payload in zip(active, payloads) if payload.get("error") and not payload.get("deferred"))
+                page_items = []
+                for n, payload in zip(active, payloads):
+                    items = [it for it in (payload.get("items", []) or []) if it.get("link") not in seen_urls[n]]
+                    seen_urls[n].update(it.get("link") for it in items)
+                    page_items.append(items)
+
+                # Semantic scoring for this page of every active row in batched encode calls
+                semantic_rows = semantic_filter_batch(
+                    [(items, todo[n][3]) for n, items in zip(active, page_items)],
+                    threshold=float(threshold),
+                    batch_size=cfg.SEMANTIC_BATCH_SIZE,
+                )
+
+                # Domain-level filter (no UI, code-controlled), one compiled matcher for all rows
+                for n, filtered in zip(active, filter_rows_by_domain(semantic_rows, matcher)):
+                    domain_rows[n].extend(filtered)
+
+                # Early stop: rows with enough links, or whose last page was short/empty
+                active = [
+                    n for n, payload in zip(active, payloads)
+                    if len(domain_rows[n]) < max_links and len(payload.get("items", []) or []) >= CSE_PAGE_SIZE
+                ]
+                left = usage.remaining_today() if budget else None
+                if left is not None and len(active) > left:
+                    active = active[:left]  # todo is in table (= value) order
+                if not active or 1 + (page + 1) * CSE_PAGE_SIZE > CSE_MAX_START:
+                    break
+                log.info("Stage 3: fetching result page %d for %d rows short of %d links", page + 2, len(active), max_links)
+
+            # Brand/domain ranking for every row with a brand in one scoring call;
+            # priorizamos solo esos links si hay coincidencia fuerte
+            to_rank = [n for n, ((_, _, brand, _, _), filtered) in enumerate(zip(todo, domain_rows)) if brand and filtered]
+            ranked = rank_links_by_brand_batch([(domain_rows[n], todo[n][2]) for n in to_rank], threshold=BRAND_MATCH_THRESHOLD)
+            for n, r in zip(to_rank, ranked):
+                domain_rows[n] = r
+            if brand_index:
+                observed.extend(
+                    (todo[n][2], None if todo[n][1].startswith("row:") else todo[n][1], domain_rows[n][:max(max_links, 10)])
+                    for n in to_rank if live[n] and todo[n][1] not in failed
+                )
+
+            for (pos, key, _, _, _), filtered in zip(todo, domain_rows):
+                if key in deferred: continue
+                links = [it["url"] for it in filtered[:max_links]]
+                window[pos][2].extend(links)
+                if key not in failed:
+                    finished_rows[key] = links
+
+        if finished_rows and on_rows:
+            on_rows(finished_rows)
+        for ck in [ck for ck in carried if later[ck[0]] <= 0]:
+            del carried[ck]
+
+        for i, record, links, key in window:
+            for j in range(max_links):
+                record[f"link_{j+1}"] = links[j] if j < len(links) else None
+            if budget:
+                record["deferred"] = key in deferred
+            yield i, record
+
+    if brand_index and observed:
+        brand_index.observe(observed, threshold=BRAND_MATCH_THRESHOLD)
+    if resumed:
+        log.info("Stage 3: %d rows restored from checkpoint", resumed)
+    if from_index:
+        log.info("Stage 3: %d rows answered from the brand->domain index", from_index)
+    if deferred:
+        log.warning("Stage 3: %d rows deferred to the next CSE quota window", len(deferred))
+    if failed:
+        log.warning("Stage 3: %d rows failed to search; they are searched again on the next run", len(failed))
+    if stats is not None:
+        cache_after = get_embedding_cache().stats()
+        stats.update({
+            # Requests made (works for simulate and real)
+            "google_requests": getattr(usage, "requests_made", "n/a"),
+            "queries_coalesced": getattr(usage, "queries_coalesced", 0) - coalesced_before,
+            "embedding_hits": cache_after["hits"] - cache_before["hits"],
+            "embedding_misses": cache_after["misses"] - cache_before["misses"],
+            "rows_resumed": resumed,
+            "rows_from_brand_index": from_index,
+            "rows_deferred": len(deferred),
+            "rows_failed": len(failed),
+        })
+
+def run_stage3(
+    df: pd.DataFrame,
+    client: GoogleClient,
+    cfg: AppConfig,
+    max_links: int,
+    threshold: float,
+    progress: Optional[ProgressFn] = None,
+    done_rows: Optional[Mapping[str, RowLinks]] = None,
+    on_rows: Optional[Callable[[Dict[str, RowLinks]], None]] = None,
+) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """Materialized Stage 3: consumes `iter_stage3` into a DataFrame. Returns (df with links, stats)."""
+    stats: Dict[str, Any] = {}
+    index, records = [], []
+    for i, record in iter_stage3(df, client, cfg, max_links, threshold, progress, done_rows, on_rows, stats):
+        index.append(i)
+        records.append(record)
+    df2 = pd.DataFrame.from_records(records, index=index, columns=link_columns(df, max_links, deferred=has_budget(client)))
+    return df2, stats
@@ -1,10 +1,16 @@
 # services/product_details.py
 from __future__ import annotations
-import logging, re, requests
+import logging, re
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Any, Dict, List
 import pandas as pd
 from config.settings import AppConfig
-from utils.typing import BestSellerRow, ProductRow
+from services.asin_store import get_asin_store
+from services.http_client import HostPolicy, get_with_retry
+from services.response_cache import OfflineCacheMiss, get_response_cache, make_cache_key
+from utils.metrics import instrumented, metrics
+from utils.typing import BestSellerRow
 
 log = logging.getLogger(__name__)
 
@@ -23,6 +29,14 @@ def parse_sales_volume(text: str | None) -> int | None:
     mult = 1_000 if suf == "k" else (1_000_000 if suf == "m" else 1)
     return int(round(base * mult))
 
+def parse_sales_volume_series(values: pd.Series) -> pd.Series:
+    """Vectorized `parse_sales_volume`: one regex extract over the whole column."""
+    parts = values.astype("object").where(values.notna(), None).str.extract(_sales_pat.pattern)
+    base = pd.to_numeric(parts["num"].str.replace(",", "", regex=False), errors="coerce")
+    mult = parts["suf"].str.lower().map({"k": 1_000, "m": 1_000_000}).fillna(1)
+    out = np.round(base.astype("float64") * mult.astype("float64"))
+    return out.astype("int64") if out.notna().all() else out
+
 def _extract_brand(item: dict) -> str | None:
     info = (item or {}).get("product_information") or {}
     details = (item or {}).get("product_details") or {}
@@ -40,56 +54,94 @@ def _normalize_details_payload(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
     if isinstance(data, dict): return [data]
     return []
 
+@instrumented("details_batch", "stage2")
 def fetch_details_batch(asins: List[str], cfg: AppConfig) -> List[Dict[str, Any]]:
     headers = {"x-rapidapi-key": cfg.RAPIDAPI_KEY or cfg.AMAZON_API_KEY, "x-rapidapi-host": cfg.API_HOST}
-    params = {"asin": ",".join(asins), "country": cfg.COUNTRY}
-    url = f"https://{cfg.API_HOST}/product-details"
-    log.info("Details: GET %s asins=%d", url, len(asins))
-    resp = requests.get(url, headers=headers, params=params, timeout=60)
-    resp.raise_for_status()
+    url = cfg.api_url("product-details")
+
+    # Cached per ASIN (not per batch string) so overlapping batches still hit
+    cache = get_response_cache(cfg)
+    key_of = {a: make_cache_key(url, {"asin": a, "country": cfg.COUNTRY}) for a in asins}
+    out: List[Dict[str, Any]] = []
+    missing: List[str] = []
+    for a in asins:
+        try:
+            cached = cache.get(key_of[a], cfg.CACHE_TTL_DETAILS_S) if cache else None
+        except OfflineCacheMiss:
+            log.warning("Details: offline mode, no cached details for %s", a)
+            continue
+        if cached is None:
+            missing.append(a)
+        else:
+            out.append(cached)
+    if cache:
+        metrics.current().cache = "hit" if not missing else ("partial" if out else "miss")
+    if not missing:
+        log.info("Details: cache hit for all %d asins", len(asins))
+        return out
+
+    params = {"asin": ",".join(missing), "country": cfg.COUNTRY}
+    log.info("Details: GET %s asins=%d (cached=%d)", url, len(missing), len(out))
+    resp = get_with_retry(
+        url, headers=headers, params=params, timeout=60,
+        max_retries=cfg.HTTP_MAX_RETRIES, backoff=cfg.HTTP_BACKOFF_S, policy=HostPolicy.from_config(cfg),
+    )
     payload = resp.json()
     if payload.get("status") != "OK":
         raise ValueError(f"product-details status != OK (status={payload.get('status')})")
-    return _normalize_details_payload(payload)
+    items = _normalize_details_payload(payload)
+    if cache:
+        for it in items:
+            a = str(it.get("asin") or "").strip()
+            if a in key_of:
+                cache.put(key_of[a], "product-details", it)
+    return out + items
 
+@instrumented("build_stage2", "stage2")
 def build_stage2_dataframe(best: List[BestSellerRow], cfg: AppConfig, stage_status=None, stage_progress=None) -> pd.DataFrame:
-    rows: List[ProductRow] = []
     asins_sorted = [r["asin"] for r in sorted(best, key=lambda x: x["rank"])]
-    batches = [asins_sorted[i:i+cfg.DETAILS_BATCH_SIZE] for i in range(0, len(asins_sorted), cfg.DETAILS_BATCH_SIZE)]
-    total = max(1, len(batches))
 
-    for i, batch in enumerate(batches, start=1):
-        if stage_status: stage_status.info(f"Fetching details batch {i}/{total} …")
-        if stage_progress: stage_progress.progress(int(5 + (i/total)*85))
-        try:
-            items = fetch_details_batch(batch, cfg)
-        except Exception as e:
-            log.exception("Details batch failed: %s", e)
-            for a in batch:
-                rank = next((r["rank"] for r in best if r["asin"] == a), None)
-                rows.append({"asin": a, "rank": rank})
-            continue
+    # Only ASINs that are missing from the store (or stale) go to RapidAPI, packed into full batches
+    store = get_asin_store(cfg)
+    fresh, stale = store.lookup(asins_sorted, cfg.COUNTRY, cfg.DETAILS_MAX_AGE_S) if store else ({}, {})
+    to_fetch = [a for a in asins_sorted if a not in fresh]
+    batches = [to_fetch[i:i+cfg.DETAILS_BATCH_SIZE] for i in range(0, len(to_fetch), cfg.DETAILS_BATCH_SIZE)]
+    total = max(1, len(batches))
+    log.info("Details: %d from store, %d to fetch in %d batches", len(fresh), len(to_fetch), len(batches))
 
-        by_asin = {str(it.get("asin")).strip(): it for it in items if it and it.get("asin")}
-        for a in batch:
-            it = by_asin.get(a)
-            rank = next((r["rank"] for r in best if r["asin"] == a), None)
-            if not it:
-                rows.append({"asin": a, "rank": rank})
-                continue
-            title = it.get("product_title")
-            sales_raw = it.get("sales_volume")
-            brand = _extract_brand(it)
-            url = it.get("product_url")
-            rows.append({
-                "asin": a, "rank": rank, "product_title": title, "brand": brand,
-                "sales_volume_raw": sales_raw, "sales_volume_num": parse_sales_volume(sales_raw),
-                "product_url": url,
-            })
+    # Fetch batches concurrently over the pooled session; results are merged back in rank order below
+    by_asin: Dict[str, Dict[str, Any]] = dict(fresh)
+    with ThreadPoolExecutor(max_workers=max(1, cfg.DETAILS_CONCURRENCY), thread_name_prefix="details") as pool:
+        futures = {pool.submit(fetch_details_batch, batch, cfg): b for b, batch in enumerate(batches)}
+        for done, fut in enumerate(as_completed(futures), start=1):
+            batch = batches[futures[fut]]
+            try:
+                items = fut.result()
+            except Exception as e:
+                log.exception("Details batch failed: %s", e)
+                items = []
+            got = {str(it.get("asin")).strip(): it for it in items if it and it.get("asin")}
+            by_asin.update(got)
+            # ASINs the batch did not return (failed batch, or left out by RapidAPI) keep their stale details
+            by_asin.update({a: stale[a] for a in batch if a not in got and a in stale})
+            if store: store.put_many(cfg.COUNTRY, got.values())
+            if stage_status: stage_status.info(f"Fetching details batch {done}/{total} …")
+            if stage_progress: stage_progress.progress(int(5 + (done/total)*85))
 
-    df = pd.DataFrame(rows, columns=[
-        "rank", "asin", "product_title", "brand", "sales_volume_raw", "sales_volume_num", "product_url"
-    ])
+    # Columnar build: asin -> rank index (first occurrence wins), one list per column
+    rank_of: Dict[str, int] = {}
+    for r in best:
+        rank_of.setdefault(r["asin"], r["rank"])
+    items = [by_asin.get(a) or {} for a in asins_sorted]
+    df = pd.DataFrame({
+        "rank": [rank_of.get(a) for a in asins_sorted],
+        "asin": asins_sorted,
+        "product_title": [it.get("product_title") for it in items],
+        "brand": [_extract_brand(it) if it else None for it in items],
+        "sales_volume_raw": [it.get("sales_volume") for it in items],
+        "product_url": [it.get("product_url") for it in items],
+    })
+    df.insert(5, "sales_volume_num", parse_sales_volume_series(df["sales_volume_raw"]))
 
     df = df.sort_values(
         by=["sales_volume_num", "rank"],
@@ -0,0 +1,112 @@
+# services/query_planner.py
+from __future__ import annotations
+import re, threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Variant tokens that do not change which manufacturer pages a search should find
+_COLORS = (
+    "black|white|red|blue|green|yellow|pink|purple|orange|brown|gray|grey|silver|gold|beige|navy|"
+    "teal|ivory|cream|clear|transparent|multicolor|multicolour|rose gold|space gray|space grey"
+)
+# No bare "in": "3-in-1" and "2-in-1" are different products
+_UNITS = r"oz|fl oz|ml|l|ltr|liter|litre|lb|lbs|g|gr|kg|mg|ct|count|pack|pk|pcs|pieces|piece|inch|inches|cm|mm|ft|gb|tb|w|mah"
+_VARIANT_RES = [
+    # Only labelled values ("Size: 12", "Color - Blue"): "Travel Size Shampoo" and "Color Wonder" are product names
+    re.compile(r"\b(?:size|color|colour)(?:\s*:|\s+-)\s*\S+"),
+    re.compile(r"\b(?:pack|set|case|box) of \d+\b"),
+    # A quantity with its unit, but not a model code such as "2-pk-3"
+    re.compile(r"\b\d+(?:\.\d+)?\s*(?:-\s*)?(?:" + _UNITS + r")\b(?!-\d)"),
+    re.compile(r"\b\d+\s*x\s*\d+(?:\.\d+)?\b"),
+    re.compile(r"\b(?:xxs|xs|xl|xxl|xxxl|2xl|3xl|small|medium|large|x-large|xx-large)\b"),
+    re.compile(r"\b(?:" + _COLORS + r")\b"),
+]
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+_WS_RE = re.compile(r"\s+")
+
+def normalize_query(query: str) -> str:
+    """
+    Canonical form of a search query: lowercase, size/color/pack variant tokens removed,
+    punctuation dropped and whitespace collapsed. Falls back to the plain lowercased query
+    if nothing is left (e.g. the query was only variant tokens).
+
+    >>> normalize_query("Hydro Flask Water Bottle, 32 oz, Color: Black")
+    'hydro flask water bottle'
+    >>> normalize_query("hydro flask water bottle 32oz (Pack of 2)")
+    'hydro flask water bottle'
+
+    Product names that only look like variants stay apart:
+
+    >>> normalize_query("Suave Travel Size Shampoo") == normalize_query("Suave Travel Size Conditioner")
+    False
+    >>> normalize_query("Crayola Color Wonder Markers") == normalize_query("Crayola Color Changing Markers")
+    False
+    >>> normalize_query("Gillette 3-in-1 Body Wash") == normalize_query("Gillette 2-in-1 Body Wash")
+    False
+    """
+    base = _WS_RE.sub(" ", str(query or "").lower()).strip()
+    q = base
+    for rx in _VARIANT_RES:
+        q = rx.sub(" ", q)
+    q = _WS_RE.sub(" ", _PUNCT_RE.sub(" ", q)).strip()
+    return q or base
+
+@dataclass
+class QueryPlan:
+    """
+    Rows grouped by normalized query: one search per entry of `queries` (the first original
+    query of each group, so the text sent stays as written), `keys` holds the normalized form
+    and `groups[row]` is the row's group index.
+    """
+    queries: List[str] = field(default_factory=list)
+    keys: List[str] = field(default_factory=list)
+    groups: List[int] = field(default_factory=list)
+
+    @property
+    def coalesced(self) -> int:
+        """Searches saved by grouping."""
+        return len(self.groups) - len(self.queries)
+
+    def fan_out(self, results: Sequence[T]) -> List[T]:
+        """Map one result per query back to one result per input row (shared, not copied)."""
+        return [results[g] for g in self.groups]
+
+def plan_queries(queries: Sequence[str]) -> QueryPlan:
+    """Group `queries` by `normalize_query`, keeping first-seen order of the groups."""
+    plan = QueryPlan()
+    seen: Dict[str, int] = {}
+    for q in queries:
+        key = normalize_query(q)
+        g = seen.get(key)
+        if g is None:
+            g = seen[key] = len(plan.queries)
+            plan.queries.append(q)
+            plan.keys.append(key)
+        plan.groups.append(g)
+    return plan
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution of `fn` and its result (or exception)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._calls[key] = Future()
+        if not leader:
+            return fut.result()
+        try:
+            fut.set_result(fn())
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return fut.result()
@@ -0,0 +1,93 @@
+# services/response_cache.py
+from __future__ import annotations
+import hashlib, json, logging, time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+from config.settings import AppConfig
+from utils.sqlite_store import SQLiteStore, StoreRegistry
+
+log = logging.getLogger(__name__)
+
+# Never part of a cache key (credentials)
+SECRET_PARAMS = {"key", "api_key", "x-rapidapi-key"}
+
+class OfflineCacheMiss(RuntimeError):
+    """Raised in offline replay mode when a response is not in the cache."""
+
+def make_cache_key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Stable key from normalized URL (scheme/host lowercased, no trailing slash) + sorted non-secret params."""
+    parts = urlsplit(url)
+    norm_url = f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path.rstrip('/')}"
+    clean = sorted((str(k), str(v)) for k, v in (params or {}).items() if str(k).lower() not in SECRET_PARAMS)
+    raw = json.dumps([norm_url, clean], separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class ResponseCache(SQLiteStore):
+    """
+    SQLite-backed TTL cache for decoded JSON responses.
+    - get() honors the caller's TTL; in offline mode any stored entry is replayed and misses raise.
+    - Size is bounded by total body bytes; least recently accessed entries are evicted first.
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS responses ("
+        " key TEXT PRIMARY KEY, endpoint TEXT, stored_at REAL, accessed_at REAL, size INTEGER, body TEXT)",
+        "CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)",
+    )
+
+    def __init__(self, path: str, max_bytes: int = 200 * 1024 * 1024, offline: bool = False):
+        super().__init__(path)
+        self.max_bytes = int(max_bytes)
+        self.offline = offline
+
+    def get(self, key: str, ttl: float) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT stored_at, body FROM responses WHERE key=?", (key,)).fetchone()
+            if row is None or (not self.offline and time.time() - row[0] > ttl):
+                if self.offline:
+                    raise OfflineCacheMiss(f"offline mode: no cached response for key {key[:12]}…")
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at=? WHERE key=?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[1])
+
+    def contains(self, key: str, ttl: float) -> bool:
+        """Whether get() would answer `key` from the cache (does not touch the entry)."""
+        with self._lock:
+            row = self._conn.execute("SELECT stored_at FROM responses WHERE key=?", (key,)).fetchone()
+        return row is not None and (self.offline or time.time() - row[0] <= ttl)
+
+    def put(self, key: str, endpoint: str, value: Any) -> None:
+        if self.offline: return
+        body = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses(key, endpoint, stored_at, accessed_at, size, body) VALUES (?,?,?,?,?,?)",
+                (key, endpoint, now, now, len(body), body),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes: return
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            victims.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes: break
+        self._conn.executemany("DELETE FROM responses WHERE key=?", victims)
+        log.info("ResponseCache: evicted %d entries (%d bytes)", len(victims), freed)
+
+_caches: StoreRegistry[ResponseCache] = StoreRegistry(ResponseCache)
+
+def get_response_cache(cfg: AppConfig) -> Optional[ResponseCache]:
+    """Shared cache for cfg.RESPONSE_CACHE_PATH, or None when caching is disabled."""
+    if not cfg.RESPONSE_CACHE_ENABLED:
+        return None
+    return _caches.get(
+        cfg.RESPONSE_CACHE_PATH,
+        max_bytes=cfg.RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+        offline=cfg.RESPONSE_CACHE_OFFLINE,
+    )
@@ -0,0 +1,128 @@
+# services/scheduler.py
+from __future__ import annotations
+import logging, os, re, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional
+from config.settings import AppConfig
+from services.best_sellers import fetch_best_sellers
+from services.checkpoints import CheckpointStore
+from services.google_client import GOOGLE_MAX_QPS, make_google_client
+from services.pipeline import has_budget, iter_stage3, link_columns
+from services.product_details import build_stage2_dataframe
+from utils.data_ops import open_row_writer, sanitize_for_stage3
+
+log = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class JobOptions:
+    out_dir: str
+    checkpoint_path: str
+    max_links: int
+    threshold: float
+    qps: float  # CSE QPS target for the whole run, split evenly across worker processes
+    out_format: str = "csv"  # csv | parquet
+
+def category_slug(category: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", category.strip()).strip("_") or "category"
+
+def process_category(category: str, opts: JobOptions, cfg: Optional[AppConfig] = None) -> Dict[str, Any]:
+    """
+    Run Stage 1 -> 2 -> 3 for one category, checkpointing after each stage and after each
+    Stage 3 chunk. Work already recorded in the checkpoint store is reused, not redone.
+    """
+    cfg = cfg or AppConfig()
+    store = CheckpointStore(opts.checkpoint_path)
+    t0 = time.perf_counter()
+
+    done = store.get_stage(category, "stage3")
+    if done is not None:
+        log.info("[%s] already complete (%s)", category, done.get("out_path"))
+        return {"category": category, "status": "skipped", **done}
+
+    best = store.get_stage(category, "stage1")
+    if best is None:
+        best = fetch_best_sellers(category, cfg)
+        store.put_stage(category, "stage1", best)
+    log.info("[%s] Stage 1: %d items", category, len(best))
+
+    df = store.get_frame(category, "stage2")
+    if df is None:
+        df = sanitize_for_stage3(build_stage2_dataframe(best, cfg), inplace=True)
+        store.put_frame(category, "stage2", df)
+    log.info("[%s] Stage 2: %d rows", category, len(df))
+
+    client = make_google_client(cfg)
+    if hasattr(client, "usage"):
+        client.usage.qps_target = float(opts.qps)
+    # Rows are streamed to disk as each Stage 3 window finishes
+    out_path = os.path.join(opts.out_dir, f"{category_slug(category)}.{opts.out_format}")
+    stats: Dict[str, Any] = {}
+    n_rows = 0
+    with open_row_writer(out_path, link_columns(df, opts.max_links, deferred=has_budget(client))) as writer:
+        for _, record in iter_stage3(
+            df, client, cfg,
+            max_links=opts.max_links,
+            threshold=opts.threshold,
+            done_rows=store.get_rows(category),
+            on_rows=lambda rows: store.put_rows(category, rows),
+            stats=stats,
+        ):
+            writer.write(record)
+            n_rows += 1
+    log.info("[%s] Stage 3: %s", category, stats)
+
+    summary = {"out_path": out_path, "rows": n_rows}
+    if stats.get("rows_deferred") or stats.get("rows_failed"):
+        # Out of CSE quota or searches failed: leave Stage 3 open so the next run searches those rows
+        log.info("[%s] wrote %s with %d rows deferred, %d failed",
+                 category, out_path, stats.get("rows_deferred", 0), stats.get("rows_failed", 0))
+        return {"category": category, "status": "partial", "deferred": stats.get("rows_deferred", 0),
+                "failed": stats.get("rows_failed", 0), **summary}
+    store.put_stage(category, "stage3", summary)
+    log.info("[%s] wrote %s in %.1fs", category, out_path, time.perf_counter() - t0)
+    return {"category": category, "status": "ok", **summary}
+
+def _init_worker(level: int) -> None:
+    # Each worker process: own logging, embedding model loaded once up front
+    from utils.logging_setup import setup_logging
+    from services.semantic import get_semantic_model
+    setup_logging(level)
+    if not AppConfig().EMBED_SERVER_SOCKET:  # with the embedding server, workers never load the model
+        get_semantic_model()
+
+def _run_one(category: str, opts: JobOptions) -> Dict[str, Any]:
+    try:
+        return process_category(category, opts)
+    except Exception as e:
+        log.exception("Category %s failed", category)
+        return {"category": category, "status": "failed", "error": str(e)}
+
+def run_jobs(categories: List[str], opts: JobOptions, workers: int = 1, level: int = logging.INFO) -> List[Dict[str, Any]]:
+    """
+    Spread categories across `workers` processes (in-process when workers <= 1); results in input order.
+    Each process rate-limits its own CSE searches, so every worker gets an equal share of `opts.qps`
+    (capped at the CSE limit) and together they never exceed it.
+    """
+    os.makedirs(opts.out_dir, exist_ok=True)
+    results: Dict[int, Dict[str, Any]] = {}
+    if workers <= 1:
+        if not AppConfig().EMBED_SERVER_SOCKET:  # with the embedding server, the model stays out of this process
+            from services.semantic import get_semantic_model
+            get_semantic_model()
+        for n, category in enumerate(categories):
+            log.info("Category %d/%d: %s", n + 1, len(categories), category)
+            results[n] = _run_one(category, opts)
+    else:
+        opts = replace(opts, qps=min(float(opts.qps), GOOGLE_MAX_QPS) / workers)
+        log.info("CSE QPS per worker: %.2f", opts.qps)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(level,)) as pool:
+            futures = {pool.submit(_run_one, c, opts): n for n, c in enumerate(categories)}
+            for fut in as_completed(futures):
+                n = futures[fut]
+                try:
+                    results[n] = fut.result()
+                except Exception as e:  # worker crashed; checkpoints keep its finished work
+                    results[n] = {"category": categories[n], "status": "failed", "error": str(e)}
+                log.info("Category %s: %s", categories[n], results[n]["status"])
+    return [results[n] for n in range(len(categories))]
@@ -1,30 +1,471 @@
 # services/semantic.py
 from __future__ import annotations
-from typing import List, Dict
-from sentence_transformers import SentenceTransformer, util
+import hashlib, json, logging, os, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, List, Dict, Optional, Sequence, Tuple
+import numpy as np
 import streamlit as st
+from config.settings import AppConfig
+from utils.metrics import instrumented, metrics
+
+if TYPE_CHECKING:  # sentence_transformers/torch are imported lazily, on first model load
+    from sentence_transformers import SentenceTransformer
+
+try:  # inter-process locking for the embedding cache (POSIX only)
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# torch: full-precision PyTorch (baseline) | onnx: ONNX Runtime graph | int8: dynamically int8-quantized Linear layers
+BACKENDS = ("torch", "onnx", "int8")
+
+def _resolve_backend(backend: Optional[str]) -> str:
+    b = (backend or AppConfig().SEMANTIC_BACKEND).lower()
+    if b not in BACKENDS:
+        raise ValueError(f"Unknown SEMANTIC_BACKEND '{b}' (expected one of {', '.join(BACKENDS)})")
+    return b
+
+def model_id(backend: Optional[str] = None) -> str:
+    """Identity of the vectors a backend produces (embedding cache and embedding server key)."""
+    backend = _resolve_backend(backend)
+    # Vectors from different backends differ slightly, so each gets its own identity
+    return MODEL_NAME if backend == "torch" else f"{MODEL_NAME}@{backend}"
+
+def _load_model(backend: str) -> SentenceTransformer:
+    from sentence_transformers import SentenceTransformer  # heavy: pulls in torch
+    if backend == "onnx":
+        # Requires sentence-transformers>=3.2 with optimum[onnxruntime]; exports the graph on first use
+        return SentenceTransformer(MODEL_NAME, device="cpu", backend="onnx")
+    model = SentenceTransformer(MODEL_NAME, device="cpu" if backend == "int8" else None)
+    if backend == "int8":
+        import torch
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+# Process-wide model registry (like st.cache_resource, but also usable from the warm-up thread)
+_models: Dict[str, "SentenceTransformer"] = {}
+_models_lock = threading.Lock()
+_warmup_thread: Optional[threading.Thread] = None
+_warmup_lock = threading.Lock()  # separate from _models_lock, which is held for the whole model load
+
+def get_semantic_model(backend: Optional[str] = None) -> SentenceTransformer:
+    backend = _resolve_backend(backend)
+    model = _models.get(backend)
+    if model is None:
+        with _models_lock:  # a concurrent caller (e.g. warm-up) finishes loading first
+            model = _models.get(backend)
+            if model is None:
+                t0 = time.perf_counter()
+                model = _models[backend] = _load_model(backend)
+                log.info("Loaded semantic model %s (backend=%s) in %.1fs", MODEL_NAME, backend, time.perf_counter() - t0)
+    return model
+
+def is_model_ready(backend: Optional[str] = None) -> bool:
+    socket_path = AppConfig().EMBED_SERVER_SOCKET
+    if socket_path:
+        from services.embed_server import get_embed_client
+        return get_embed_client(socket_path).ping(model_id(backend))
+    return _resolve_backend(backend) in _models
+
+def warm_up_model(backend: Optional[str] = None) -> Optional[threading.Thread]:
+    """
+    Load the model on a background daemon thread (once per process), so Stage 3 finds it ready.
+    Nothing to do when encoding goes to the embedding server.
+    """
+    global _warmup_thread
+    if AppConfig().EMBED_SERVER_SOCKET:
+        return None
+    with _warmup_lock:
+        if _warmup_thread is None:
+            def _run() -> None:
+                try:
+                    get_semantic_model(backend)
+                except Exception:
+                    log.exception("Semantic model warm-up failed")
+            _warmup_thread = threading.Thread(target=_run, name="model-warmup", daemon=True)
+            _warmup_thread.start()
+        return _warmup_thread
+
+def _normalize_text(text: str) -> str:
+    # MiniLM-L6-v2 is uncased: lowercasing + whitespace collapsing keeps embeddings identical
+    return " ".join(str(text).split()).lower()
+
+@contextmanager
+def _interprocess_lock(path: str, shared: bool = False):
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+# Index journal record: a key's sha1 digest and the slot it now holds (later records win)
+_LOG_RECORD = np.dtype([("key", np.uint8, (20,)), ("slot", "<u4")])
+COMPACT_MIN_RECORDS = 10_000
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache: a memory-mapped float32 matrix (one row per slot) plus a key
+    index kept in LRU order. Keys are sha1(model name + normalized text). When full, the least
+    recently used slot is reused. Writers from several processes are serialized with a file lock
+    and pick up each other's index changes before writing.
+
+    The index is a JSON snapshot plus an append-only journal of fixed-size (digest, slot)
+    records: each put_many appends only the keys it wrote or read since the last write, and
+    the journal is folded into a new snapshot once it outgrows the index. Other processes
+    replay just the journal records they have not seen yet.
+
+    Each slot also records the digest of the key it holds, checked on every read under a
+    shared lock: another process may have evicted and reused a slot since this process
+    loaded its index, and such a slot must read as a miss, not as another text's vector.
+    """
+    def __init__(self, directory: str, model_name: str, max_items: int = 100_000):
+        self.model_name = model_name
+        self.max_items = max(1, int(max_items))
+        self.dir = os.path.join(directory, model_name.replace("/", "__"))
+        self.index_path = os.path.join(self.dir, "index.json")
+        self.log_path = os.path.join(self.dir, "index.log")
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.slot_keys_path = os.path.join(self.dir, "slot_keys.bin")
+        self.lock_path = os.path.join(self.dir, "lock")
+        self._seen_index: Optional[Tuple[int, int]] = None  # (inode, mtime) of the snapshot we loaded
+        self._log_pos = 0      # journal bytes already applied
+        self._log_records = 0  # journal records since the snapshot
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._slots: "OrderedDict[str, int]" = OrderedDict()  # key -> slot, oldest first
+        self._owner: Dict[int, str] = {}  # slot -> key
+        self._touched: "OrderedDict[str, None]" = OrderedDict()  # read hits not yet journaled
+        self._dim: Optional[int] = None
+        self._mat: Optional[np.memmap] = None
+        self._slot_keys: Optional[np.memmap] = None  # (max_items, 20) sha1 digest per slot
+        os.makedirs(self.dir, exist_ok=True)
+        self._load()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{_normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _index_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            info = os.stat(self.index_path)
+        except OSError:
+            return None
+        return info.st_ino, info.st_mtime_ns
+
+    def _assign(self, k: str, slot: int) -> None:
+        old = self._owner.get(slot)
+        if old is not None and old != k:
+            del self._slots[old]  # the slot was reused for another key
+        prev = self._slots.pop(k, None)
+        if prev is not None and prev != slot:
+            del self._owner[prev]
+        self._slots[k] = slot
+        self._owner[slot] = k
+
+    def _drop(self, k: str) -> None:
+        slot = self._slots.pop(k)
+        if self._owner.get(slot) == k:
+            del self._owner[slot]
+
+    def _load(self) -> None:
+        self._slots.clear(); self._owner.clear(); self._touched.clear()
+        self._dim = None; self._mat = None; self._slot_keys = None
+        self._log_pos = self._log_records = 0
+        self._seen_index = self._index_stamp()
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if (int(meta.get("capacity", 0)) != self.max_items
+                    or not os.path.exists(self.vectors_path) or not os.path.exists(self.slot_keys_path)):
+                log.info("EmbeddingCache: capacity changed or vectors missing, starting empty")
+                return
+            self._dim = int(meta["dim"])
+            for k, v in meta["keys"]:
+                self._assign(k, int(v))
+            self._mat = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.max_items, self._dim))
+            self._slot_keys = np.memmap(self.slot_keys_path, dtype=np.uint8, mode="r+", shape=(self.max_items, 20))
+            self._replay_log()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning("EmbeddingCache: unreadable index, starting empty (%s)", e)
+            self._slots.clear(); self._owner.clear(); self._dim = None; self._mat = None; self._slot_keys = None
+
+    def _refresh(self) -> None:
+        """Catch up with other processes: reload after a compaction, else replay new journal records."""
+        if self._index_stamp() != self._seen_index:
+            touched = list(self._touched)
+            self._load()
+            self._touched.update((k, None) for k in touched if k in self._slots)
+        else:
+            self._replay_log()
+
+    def _replay_log(self) -> None:
+        """Apply journal records written (by any process) since we last read it."""
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_pos)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        n = len(data) // _LOG_RECORD.itemsize  # a torn trailing record is read once complete
+        recs = np.frombuffer(data, dtype=_LOG_RECORD, count=n)
+        for digest, slot in zip(recs["key"], recs["slot"].tolist()):
+            if slot < self.max_items:
+                self._assign(digest.tobytes().hex(), slot)
+        self._log_pos += n * _LOG_RECORD.itemsize
+        self._log_records += n
+
+    def _append_log(self, entries: Sequence[Tuple[str, int]]) -> None:
+        if not entries: return
+        recs = np.empty(len(entries), dtype=_LOG_RECORD)
+        recs["key"] = np.frombuffer(b"".join(bytes.fromhex(k) for k, _ in entries), dtype=np.uint8).reshape(-1, 20)
+        recs["slot"] = [slot for _, slot in entries]
+        with open(self.log_path, "ab") as f:
+            f.write(recs.tobytes())
+        self._log_pos += recs.nbytes
+        self._log_records += len(entries)
+        if self._log_records > max(COMPACT_MIN_RECORDS, 2 * len(self._slots)):
+            self._write_snapshot()
+
+    def _write_snapshot(self) -> None:
+        """Fold the journal into a fresh index.json and start an empty journal."""
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self._dim, "capacity": self.max_items, "keys": list(self._slots.items())}, f)
+        os.replace(tmp, self.index_path)
+        open(self.log_path, "wb").close()
+        self._log_pos = self._log_records = 0
+        self._seen_index = self._index_stamp()
+
+    def _ensure_matrix(self, dim: int) -> np.memmap:
+        if self._mat is None or self._dim != dim:
+            self._dim = dim
+            self._slots.clear(); self._owner.clear(); self._touched.clear()
+            self._mat = np.memmap(self.vectors_path, dtype=np.float32, mode="w+", shape=(self.max_items, dim))
+            self._slot_keys = np.memmap(self.slot_keys_path, dtype=np.uint8, mode="w+", shape=(self.max_items, 20))
+            self._write_snapshot()
+        return self._mat
+
+    def _flush(self) -> None:
+        if self._mat is None: return
+        self._mat.flush()
+        self._slot_keys.flush()
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[np.ndarray]]:
+        out: List[Optional[np.ndarray]] = []
+        with self._lock, _interprocess_lock(self.lock_path, shared=True):
+            self._refresh()
+            for k in keys:
+                slot = self._slots.get(k)
+                if slot is not None and self._mat is not None and self._slot_keys[slot].tobytes() != bytes.fromhex(k):
+                    self._drop(k)  # slot reused by another process for a different key
+                    slot = None
+                if slot is None or self._mat is None:
+                    self.misses += 1
+                    out.append(None)
+                    continue
+                self._slots.move_to_end(k)
+                self._touched[k] = None  # journaled with the next write
+                self._touched.move_to_end(k)
+                self.hits += 1
+                out.append(np.array(self._mat[slot]))
+        return out
+
+    def put_many(self, keys: Sequence[str], vectors: np.ndarray) -> None:
+        if not len(keys): return
+        with self._lock, _interprocess_lock(self.lock_path):
+            self._refresh()
+            mat = self._ensure_matrix(int(vectors.shape[1]))
+            slot_keys = self._slot_keys
+            journal: List[Tuple[str, int]] = []
+            for k in self._touched:  # recency of reads since the last write
+                if k in self._slots:
+                    self._slots.move_to_end(k)
+                    journal.append((k, self._slots[k]))
+            self._touched.clear()
+            for k, vec in zip(keys, vectors):
+                slot = self._slots.get(k)
+                if slot is None:
+                    if len(self._slots) < self.max_items:
+                        slot = len(self._slots)
+                    else:
+                        slot = self._slots[next(iter(self._slots))]  # evict LRU
+                    self._assign(k, slot)
+                else:
+                    self._slots.move_to_end(k)
+                mat[slot] = vec
+                slot_keys[slot] = np.frombuffer(bytes.fromhex(k), dtype=np.uint8)
+                journal.append((k, slot))
+            self._flush()
+            self._append_log(journal)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._slots)}
 
 @st.cache_resource(show_spinner=False)
-def get_semantic_model() -> SentenceTransformer:
-    return SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+def _cached_embedding_cache(backend: str) -> EmbeddingCache:
+    cfg = AppConfig()
+    return EmbeddingCache(cfg.EMBED_CACHE_DIR, model_id(backend), cfg.EMBED_CACHE_MAX_ITEMS)
+
+def get_embedding_cache(backend: Optional[str] = None) -> EmbeddingCache:
+    return _cached_embedding_cache(_resolve_backend(backend))
+
+def _encode(model: SentenceTransformer, texts: Sequence[str], batch_size: int) -> np.ndarray:
+    return model.encode(
+        list(texts),
+        batch_size=max(1, int(batch_size)),
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    ).astype(np.float32, copy=False)
+
+def _encode_missing(texts: Sequence[str], batch_size: int, backend: str) -> np.ndarray:
+    """Encode via the shared embedding server when EMBED_SERVER_SOCKET is set, else in-process."""
+    socket_path = AppConfig().EMBED_SERVER_SOCKET
+    if socket_path:
+        from services.embed_server import EmbedServerError, get_embed_client
+        try:
+            return get_embed_client(socket_path).encode(texts, model_id(backend))
+        except (OSError, EmbedServerError) as e:
+            log.warning("Embedding server at %s unavailable (%s); encoding in-process", socket_path, e)
+    return _encode(get_semantic_model(backend), texts, batch_size)
+
+def encode_texts(texts: Sequence[str], batch_size: int = 64, backend: Optional[str] = None) -> np.ndarray:
+    """Encode texts to L2-normalized float32 vectors, serving cache hits without touching the model."""
+    backend = _resolve_backend(backend)
+    cache = get_embedding_cache(backend)
+    keys = [cache.key(t) for t in texts]
+    cached = cache.get_many(keys)
+    missing = [n for n, v in enumerate(cached) if v is None]
+    span = metrics.current()
+    if span and texts:
+        span.cache = "hit" if not missing else ("partial" if len(missing) < len(texts) else "miss")
+    if missing:
+        with metrics.span("semantic_encode", "stage3"):
+            fresh = _encode_missing([texts[n] for n in missing], batch_size, backend)
+        cache.put_many([keys[n] for n in missing], fresh)
+        for n, vec in zip(missing, fresh):
+            cached[n] = vec
+    if not cached:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.vstack(cached).astype(np.float32, copy=False)
+
+def _item_text(it: Dict) -> str:
+    title = it.get("title") or ""
+    snippet = it.get("snippet") or ""
+    return f"{title} {snippet}".strip()
+
+@instrumented("semantic_filter", "stage3")
+def semantic_filter_batch(
+    rows: Sequence[Tuple[List[Dict], str]],
+    threshold: float = 0.50,
+    batch_size: int = 64,
+) -> List[List[Dict]]:
+    """
+    Batched version of `semantic_filter` for a whole table.
+    `rows` is a list of (items, target_text) pairs; every unique text across all rows is
+    encoded once (in chunks of `batch_size`), then all similarities are computed in one
+    vectorized step. Returns one filtered/sorted list per input row.
+    """
+    out: List[List[Dict]] = [[] for _ in rows]
+    uniq: Dict[str, int] = {}
+    pair_row: List[int] = []
+    pair_target: List[int] = []
+    pair_text: List[int] = []
+    pair_item: List[Dict] = []
+    for r, (items, target_text) in enumerate(rows):
+        if not items: continue
+        t_idx = uniq.setdefault(target_text, len(uniq))
+        for it in items:
+            if not it.get("link"): continue
+            pair_row.append(r)
+            pair_target.append(t_idx)
+            pair_text.append(uniq.setdefault(_item_text(it), len(uniq)))
+            pair_item.append(it)
+    if not pair_item:
+        return out
+
+    embs = encode_texts(list(uniq.keys()), batch_size=batch_size)
+    # Cosine similarity of L2-normalized vectors == row-wise dot product
+    sims = np.einsum("ij,ij->i", embs[pair_target], embs[pair_text])
+
+    for r, it, sim in zip(pair_row, pair_item, sims.tolist()):
+        if sim >= threshold:
+            out[r].append({
+                "title": it.get("title") or "", "url": it.get("link"),
+                "snippet": it.get("snippet") or "", "similarity": round(sim, 3),
+            })
+    for scored in out:
+        scored.sort(key=lambda x: x["similarity"], reverse=True)
+    return out
 
 def semantic_filter(items: List[Dict], target_text: str, threshold: float = 0.50) -> List[Dict]:
     if not items: return []
-    model = get_semantic_model()
-    target_emb = model.encode(target_text, convert_to_tensor=True)
-    scored = []
-    for it in items:
-        title = it.get("title") or ""
-        snippet = it.get("snippet") or ""
-        link = it.get("link")
-        if not link: continue
-        text = f"{title} {snippet}".strip()
-        text_emb = model.encode(text, convert_to_tensor=True)
-        sim = float(util.cos_sim(target_emb, text_emb).item())
-        if sim >= threshold:
-            scored.append({"title": title, "url": link, "snippet": snippet, "similarity": round(sim, 3)})
-    scored.sort(key=lambda r: r["similarity"], reverse=True)
-    return scored
+    return semantic_filter_batch([(items, target_text)], threshold=threshold)[0]
+
+# Fixed (target, search result) sample used to compare backends against the torch baseline
+DRIFT_SAMPLE: Tuple[Tuple[str, str], ...] = (
+    ("Flexzilla Garden Hose 5/8 in. x 50 ft, Heavy Duty", "Flexzilla Garden Hose 5/8 in. x 50 ft - Flexzilla official site, lightweight, kink-free hybrid polymer hose."),
+    ("Flexzilla Garden Hose 5/8 in. x 50 ft, Heavy Duty", "Best garden hoses of the year: we tested 20 hoses for kinks and leaks."),
+    ("Flexzilla Garden Hose 5/8 in. x 50 ft, Heavy Duty", "Chocolate chip cookie recipe with brown butter and sea salt."),
+    ("Fiskars Steel Bow Rake, 16 Inch", "Fiskars 16 inch steel bow rake with welded steel head and comfortable grip."),
+    ("Fiskars Steel Bow Rake, 16 Inch", "Fiskars scissors and crafting tools for kids and adults."),
+    ("Fiskars Steel Bow Rake, 16 Inch", "How to level a lawn with a landscape rake: step by step guide."),
+    ("Orbit 58910 Traveling Sprinkler", "Orbit 58910 traveling sprinkler follows the hose path for up to 200 ft."),
+    ("Orbit 58910 Traveling Sprinkler", "Orbit B-hyve smart Wi-Fi sprinkler timer, 6 zone controller."),
+    ("Orbit 58910 Traveling Sprinkler", "Stock market news today: indexes close higher on tech rally."),
+    ("Melnor Oscillating Sprinkler with Timer", "Melnor XT oscillating sprinkler with built-in timer and flow control."),
+    ("Melnor Oscillating Sprinkler with Timer", "Hose nozzle buying guide: pistol grip vs. dial nozzles."),
+    ("Gilmour Heavy Duty Brass Hose Nozzle", "Gilmour commercial-grade brass twist nozzle, adjustable spray."),
+    ("Gilmour Heavy Duty Brass Hose Nozzle", "Brass instruments for beginners: trumpets and trombones."),
+    ("Acme Ergonomic Garden Shovel", "Ergonomic round point shovel with D-handle, reduces back strain."),
+    ("Acme Ergonomic Garden Shovel", "Snow shovel reviews: the best shovels for heavy snow."),
+    ("Acme Ergonomic Garden Shovel", "Acme Corporation cartoon history and famous products."),
+)
+
+def evaluate_backend_drift(
+    backend: str,
+    threshold: float = 0.50,
+    sample: Sequence[Tuple[str, str]] = DRIFT_SAMPLE,
+) -> Dict[str, float]:
+    """
+    Compare `backend` with the torch baseline on a fixed sample of (target, result) pairs:
+    similarity drift (max/mean abs diff), threshold decision flips, and encode time per backend.
+    Bypasses the embedding cache so both sides actually run their model.
+    """
+    texts = list(dict.fromkeys(t for pair in sample for t in pair))
+    pos = {t: n for n, t in enumerate(texts)}
+    a_idx = [pos[a] for a, _ in sample]
+    b_idx = [pos[b] for _, b in sample]
+
+    def _sims(name: str) -> Tuple[np.ndarray, float]:
+        model = get_semantic_model(name)
+        _encode(model, texts[:2], 2)  # warm-up
+        t0 = time.perf_counter()
+        embs = _encode(model, texts, 64)
+        return np.einsum("ij,ij->i", embs[a_idx], embs[b_idx]), time.perf_counter() - t0
+
+    base, base_s = _sims("torch")
+    cand, cand_s = _sims(_resolve_backend(backend))
+    diff = np.abs(base - cand)
+    return {
+        "backend": backend,
+        "pairs": len(sample),
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "decision_flips": int(((base >= threshold) != (cand >= threshold)).sum()),
+        "baseline_encode_s": round(base_s, 4),
+        "backend_encode_s": round(cand_s, 4),
+    }
 
 def build_query(brand: str | None, title: str | None) -> str:
     parts = []
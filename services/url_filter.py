@@ -1,11 +1,15 @@
 # services/url_filter.py
 from __future__ import annotations
-from typing import List, Dict
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 from urllib.parse import urlparse
-import os
+import os, threading
+from utils.metrics import instrumented
 
 # Path to the exclusion file (relative to project root)
 DEFAULT_EXCLUDED_FILE = os.path.join(os.path.dirname(__file__), "excluded_domains.txt")
+FALLBACK_EXCLUDED = ["amazon.com", "ebay.com", "walmart.com"]
 
 def _parse_domain(url: str) -> str:
     """Extracts the host: lowercase, strips 'www.', ignores ports."""
@@ -19,32 +23,110 @@ def _parse_domain(url: str) -> str:
     except Exception:
         return ""
 
-def _endswith_any(host: str, domains: List[str]) -> bool:
+class _AhoCorasick:
+    """Minimal Aho-Corasick automaton: answers "does text contain any pattern?" in one pass."""
+    def __init__(self, patterns: Sequence[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[bool] = [False]
+        for p in patterns:
+            if not p: continue
+            node = 0
+            for ch in p:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({}); self.fail.append(0); self.out.append(False)
+                node = nxt
+            self.out[node] = True
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] or self.out[self.fail[nxt]]
+
+    def search(self, text: str) -> bool:
+        node = 0
+        goto, fail, out = self.goto, self.fail, self.out
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                return True
+        return False
+
+class DomainMatcher:
     """
-    Checks whether host matches or contains the base domain.
-    If domain is 'amazon.com', then any host containing 'amazon' is excluded.
+    Precompiled exclusion rules.
+    - "amazon.com"   -> any host containing the base "amazon" (legacy semantics, via Aho-Corasick)
+    - "=example.co"  -> exact-domain rule: the host itself or any of its subdomains (via reversed-label trie)
+    Every plain rule is also put in the trie, so exact/subdomain hits skip the substring scan.
     """
-    host = host.lower().strip()
-    for d in domains:
-        d_clean = d.strip().lower()
-        if not d_clean:
-            continue
-        # Extract the base part before the first dot in d_clean
-        base = d_clean.split(".", 1)[0]  # e.g. "amazon"
-        # If host contains base as a substring, exclude
-        if base and (base in host):
-            return True
-    return False
+    _END = ""
+
+    def __init__(self, rules: Sequence[str]):
+        self.trie: Dict[str, dict] = {}
+        bases: List[str] = []
+        for rule in rules:
+            r = rule.strip().lower()
+            if not r: continue
+            exact = r.startswith("=")
+            domain = r.lstrip("=").strip(".")
+            if not domain: continue
+            node = self.trie
+            for label in reversed(domain.split(".")):
+                node = node.setdefault(label, {})
+            node[self._END] = True
+            if not exact:
+                bases.append(domain.split(".", 1)[0])  # e.g. "amazon"
+        self.automaton = _AhoCorasick(sorted(set(bases)))
+
+    def _suffix_hit(self, host: str) -> bool:
+        node = self.trie
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None: return False
+            if self._END in node: return True
+        return False
+
+    def matches(self, host: str) -> bool:
+        host = host.lower().strip()
+        if not host: return False
+        return self._suffix_hit(host) or self.automaton.search(host)
+
+@lru_cache(maxsize=8)
+def _compile(rules: Tuple[str, ...]) -> DomainMatcher:
+    return DomainMatcher(rules)
+
+_file_cache: Dict[str, Tuple[float, List[str]]] = {}
+_file_lock = threading.Lock()
 
 def _load_default_excluded() -> List[str]:
-    """Reads default excluded domains from a text file."""
+    """Reads default excluded domains from a text file (re-read only when its mtime changes)."""
     try:
-        with open(DEFAULT_EXCLUDED_FILE, "r", encoding="utf-8") as f:
-            lines = [line.strip().lower() for line in f.readlines() if line.strip()]
-        return lines or ["amazon.com", "ebay.com", "walmart.com"]
-    except FileNotFoundError:
+        mtime = os.path.getmtime(DEFAULT_EXCLUDED_FILE)
+    except OSError:
         # Fallback if file missing
-        return ["amazon.com", "ebay.com", "walmart.com"]
+        return list(FALLBACK_EXCLUDED)
+    with _file_lock:
+        hit = _file_cache.get(DEFAULT_EXCLUDED_FILE)
+        if hit and hit[0] == mtime:
+            return hit[1]
+        try:
+            with open(DEFAULT_EXCLUDED_FILE, "r", encoding="utf-8") as f:
+                lines = [line.strip().lower() for line in f.readlines() if line.strip()]
+        except FileNotFoundError:
+            return list(FALLBACK_EXCLUDED)
+        domains = lines or list(FALLBACK_EXCLUDED)
+        _file_cache[DEFAULT_EXCLUDED_FILE] = (mtime, domains)
+        return domains
 
 def get_excluded_domains() -> List[str]:
     """
@@ -56,14 +138,36 @@ def get_excluded_domains() -> List[str]:
         return [d.strip().lower() for d in env_val.replace(",", "\n").splitlines() if d.strip()]
     return _load_default_excluded()
 
-def filter_items_by_domain(items: List[Dict], excluded: List[str]) -> List[Dict]:
+def get_domain_matcher(excluded: Optional[List[str]] = None) -> DomainMatcher:
+    """Compiled matcher for `excluded` (default: current exclusion list); compiled once per distinct list."""
+    return _compile(tuple(get_excluded_domains() if excluded is None else excluded))
+
+Excluded = Union[List[str], DomainMatcher]
+
+def _as_matcher(excluded: Excluded) -> DomainMatcher:
+    return excluded if isinstance(excluded, DomainMatcher) else get_domain_matcher(excluded)
+
+def filter_items_by_domain(items: List[Dict], excluded: Excluded) -> List[Dict]:
     """Filters Google CSE results by excluding unwanted domains."""
-    out: List[Dict] = []
-    for it in items:
-        link = (it or {}).get("link") or it.get("url")
-        if not link:
-            continue
-        host = _parse_domain(link)
-        if not _endswith_any(host, excluded):
-            out.append(it)
+    return filter_rows_by_domain([items], excluded)[0]
+
+@instrumented("domain_filter", "stage3")
+def filter_rows_by_domain(rows: Sequence[List[Dict]], excluded: Excluded) -> List[List[Dict]]:
+    """Filters many rows of results at once: one compiled matcher, each distinct host checked once."""
+    matcher = _as_matcher(excluded)
+    verdict: Dict[str, bool] = {}
+    out: List[List[Dict]] = []
+    for items in rows:
+        kept: List[Dict] = []
+        for it in items or []:
+            link = (it or {}).get("link") or (it or {}).get("url")
+            if not link:
+                continue
+            host = _parse_domain(link)
+            blocked = verdict.get(host)
+            if blocked is None:
+                blocked = verdict[host] = matcher.matches(host)
+            if not blocked:
+                kept.append(it)
+        out.append(kept)
     return out
@@ -1,44 +1,175 @@
 # utils/data_ops.py
 from __future__ import annotations
+import csv, importlib.util, tempfile
 import pandas as pd
-from typing import Any
+from typing import Any, Dict, List, Mapping, Sequence
+
+# pyarrow is optional: enables Arrow-backed string columns and Parquet export
+ARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
 
 def clean_text(value: Any) -> str:
     """
     Safe string cleaner:
-    - None or NaN -> ""
+    - None, NaN or pd.NA -> ""
     - else -> stripped string
     """
-    if value is None:
-        return ""
-    # Pandas NaN is a float
-    if isinstance(value, float) and pd.isna(value):
+    if _is_missing(value):
         return ""
     return str(value).strip()
 
-def sanitize_for_stage3(df: pd.DataFrame) -> pd.DataFrame:
+def sanitize_for_stage3(df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
     """
     Make sure Stage 3 receives a safe DataFrame:
     - Ensure columns exist
     - Replace NaN with ""
     - Strip strings for 'brand' and 'product_title'
     - Keep other columns untouched
+    Vectorized string ops; with inplace=True the frame is modified without a copy.
     """
-    out = df.copy()
+    out = df if inplace else df.copy()
 
-    # Ensure columns exist
     for col in ["brand", "product_title"]:
         if col not in out.columns:
             out[col] = ""
+            continue
+        # Replace NaN with "" only in these two columns (avoid touching numerics)
+        s = out[col]
+        out[col] = s.where(s.notna(), "").astype(str).str.strip()
+
+    return out
 
-    # Replace NaN with "" only in these two columns (avoid touching numerics)
-    out["brand"] = out["brand"].map(clean_text)
-    out["product_title"] = out["product_title"].map(clean_text)
+def enable_copy_on_write() -> None:
+    """Turn on pandas Copy-on-Write (default from pandas 3), so stage hand-offs share memory until written."""
+    try:
+        pd.set_option("mode.copy_on_write", True)
+    except Exception:  # option removed once CoW is always on
+        pass
 
+def compact_frame(df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
+    """
+    Compact dtypes for result tables kept in session state:
+    - brand: categorical (few distinct values)
+    - asin, link_*: Arrow-backed strings (falls back to object when pyarrow is missing)
+    """
+    out = df if inplace else df.copy(deep=False)
+    if "brand" in out.columns:
+        out["brand"] = out["brand"].astype("category")
+    if ARROW_AVAILABLE:
+        for col in ["asin"] + [c for c in out.columns if str(c).startswith("link_")]:
+            if col in out.columns:
+                out[col] = out[col].astype("string[pyarrow]")
     return out
 
-def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+def df_to_csv_download(df: pd.DataFrame) -> bytes:
     """
-    Convert a DataFrame to CSV bytes for Streamlit download_button.
+    CSV bytes for Streamlit download_button, written in chunks through an anonymous temp file
+    (no intermediate str); the file is closed, and so deleted, before returning.
     """
-    return df.to_csv(index=False).encode("utf-8")
+    with tempfile.TemporaryFile() as fh:
+        df.to_csv(fh, index=False, encoding="utf-8")
+        fh.seek(0)
+        return fh.read()
+
+def df_to_parquet_download(df: pd.DataFrame) -> bytes:
+    """Parquet bytes for Streamlit download_button (temp file closed before returning). Requires pyarrow."""
+    with tempfile.TemporaryFile() as fh:
+        df.to_parquet(fh, index=False)
+        fh.seek(0)
+        return fh.read()
+
+class CSVRowWriter:
+    """Append rows to a CSV file as they arrive (constant memory)."""
+    def __init__(self, path: str, columns: Sequence[str]):
+        self.path = path
+        self.columns = list(columns)
+        self._fh = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._fh, fieldnames=self.columns, extrasaction="ignore")
+        self._writer.writeheader()
+
+    def write(self, record: Mapping[str, Any]) -> None:
+        self._writer.writerow({c: ("" if _is_missing(record.get(c)) else record.get(c)) for c in self.columns})
+        self._fh.flush()
+
+    def close(self) -> None:
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+class ParquetRowWriter:
+    """Append rows to a Parquet file, one row group per `row_group_size` rows (requires pyarrow)."""
+    def __init__(self, path: str, columns: Sequence[str], row_group_size: int = 1000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa, self._pq = pa, pq
+        self.path = path
+        self.columns = list(columns)
+        self.row_group_size = row_group_size
+        self._buf: List[Dict[str, Any]] = []
+        self._writer = None
+
+    def write(self, record: Mapping[str, Any]) -> None:
+        self._buf.append({c: (None if _is_missing(record.get(c)) else record.get(c)) for c in self.columns})
+        if len(self._buf) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._buf: return
+        pa = self._pa
+        if self._writer is None:
+            inferred = pa.Table.from_pylist(self._buf).schema
+            # Columns that are all-null in the first group (e.g. link_3) are stored as strings
+            schema = pa.schema([
+                pa.field(c, pa.string() if pa.types.is_null(inferred.field(c).type) else inferred.field(c).type)
+                for c in self.columns
+            ])
+            self._writer = self._pq.ParquetWriter(self.path, schema)
+        self._writer.write_table(pa.Table.from_pylist(self._buf, schema=self._writer.schema))
+        self._buf = []
+
+    def close(self) -> None:
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def _is_missing(value: Any) -> bool:
+    # None, float NaN and pd.NA (Arrow/categorical columns)
+    return value is None or value is pd.NA or (isinstance(value, float) and pd.isna(value))
+
+def read_stage3_csv(path: str, like: pd.DataFrame) -> pd.DataFrame:
+    """
+    Read a Stage 3 CSV written by CSVRowWriter back with explicit dtypes instead of re-inferring them:
+    - brand, product_title: str, "" kept as "" (as sanitize_for_stage3 left them)
+    - asin, sales_volume_raw, product_url, link_*: str ("" -> NaN), so digit-only ASINs keep leading zeros
+    - deferred: nullable boolean
+    - other columns: the dtype they have in `like` (the Stage 3 input frame)
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    dtype: Dict[str, Any] = {}
+    na_values: Dict[str, List[str]] = {}
+    for col in header:
+        na_values[col] = [""]
+        if col in ("brand", "product_title"):
+            dtype[col], na_values[col] = str, []
+        elif col in ("asin", "sales_volume_raw", "product_url") or str(col).startswith("link_"):
+            dtype[col] = str
+        elif col == "deferred":
+            dtype[col] = "boolean"
+        elif col in like.columns:
+            dtype[col] = like[col].dtype
+    return pd.read_csv(path, dtype=dtype, keep_default_na=False, na_values=na_values)
+
+def open_row_writer(path: str, columns: Sequence[str]):
+    """Streaming writer chosen by extension: .parquet -> ParquetRowWriter, otherwise CSV."""
+    if path.lower().endswith(".parquet"):
+        return ParquetRowWriter(path, columns)
+    return CSVRowWriter(path, columns)
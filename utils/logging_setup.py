@@ -1,27 +1,75 @@
 # utils/logging_setup.py
 from __future__ import annotations
-import logging
-from typing import List
+import atexit, logging, queue, threading
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+from typing import Deque, Iterable, List, Optional
 
 class InMemoryLogHandler(logging.Handler):
-    """Collect log records in memory for UI display."""
+    """
+    Keep the last `capacity` log records in memory for UI display. Records are stored raw in a
+    fixed-size ring buffer (O(1) per record) and only formatted when the UI reads them.
+    """
     def __init__(self, capacity: int = 500):
         super().__init__()
         self.capacity = capacity
-        self.records: List[str] = []
+        self._buf: Deque[logging.LogRecord] = deque(maxlen=capacity)
+        self._buf_lock = threading.Lock()
 
     def emit(self, record: logging.LogRecord) -> None:
-        msg = self.format(record)
-        self.records.append(msg)
-        if len(self.records) > self.capacity:
-            self.records.pop(0)
+        if record.exc_info:
+            # Render the traceback now instead of keeping frames alive in the buffer
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        with self._buf_lock:
+            self._buf.append(record)
+
+    def _snapshot(self) -> List[logging.LogRecord]:
+        with self._buf_lock:
+            return list(self._buf)
+
+    @property
+    def records(self) -> List[str]:
+        """All buffered records, formatted (oldest first)."""
+        return [self.format(r) for r in self._snapshot()]
+
+    def entries(self, level: int = logging.NOTSET, loggers: Optional[Iterable[str]] = None, limit: int = 300) -> List[str]:
+        """The latest `limit` formatted records at or above `level`, optionally only from `loggers` (and their children)."""
+        prefixes = tuple(loggers or ())
+        picked = [
+            r for r in self._snapshot()
+            if r.levelno >= level and (not prefixes or any(r.name == p or r.name.startswith(p + ".") for p in prefixes))
+        ]
+        return [self.format(r) for r in picked[-limit:]]
+
+    def logger_names(self) -> List[str]:
+        return sorted({r.name for r in self._snapshot()})
+
+    def clear(self) -> None:
+        with self._buf_lock:
+            self._buf.clear()
+
+# Console output runs on a listener thread; worker threads only enqueue
+_listener: Optional[QueueListener] = None
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # drains the queue
+        _listener = None
+
+atexit.register(_stop_listener)
 
 def setup_logging(level: int = logging.INFO) -> InMemoryLogHandler:
     logger = logging.getLogger()
     logger.setLevel(level)
-    # Avoid duplicate handlers during hot-reload
+    # Avoid duplicate handlers during hot-reload; the ring buffer itself survives reruns
+    mem: Optional[InMemoryLogHandler] = None
     for h in list(logger.handlers):
+        if mem is None and isinstance(h, InMemoryLogHandler):
+            mem = h
         logger.removeHandler(h)
+    _stop_listener()
 
     fmt = logging.Formatter(
         "[%(asctime)s] %(levelname)s - %(name)s - %(message)s",
@@ -31,9 +79,13 @@ def setup_logging(level: int = logging.INFO) -> InMemoryLogHandler:
     console = logging.StreamHandler()
     console.setLevel(level)
     console.setFormatter(fmt)
-    logger.addHandler(console)
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    global _listener
+    _listener = QueueListener(log_queue, console, respect_handler_level=True)
+    _listener.start()
+    logger.addHandler(QueueHandler(log_queue))
 
-    mem = InMemoryLogHandler()
+    mem = mem or InMemoryLogHandler()
     mem.setLevel(level)
     mem.setFormatter(fmt)
     logger.addHandler(mem)
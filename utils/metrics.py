@@ -0,0 +1,148 @@
+# utils/metrics.py
+from __future__ import annotations
+import bisect, functools, json, threading, time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds (seconds) of the duration histogram buckets; +Inf is implicit
+BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+@dataclass
+class Span:
+    """One instrumented call. Code inside the span may set bytes/retries/cache."""
+    op: str
+    stage: str
+    started: float = field(default_factory=time.time)
+    duration_s: float = 0.0
+    bytes: int = 0
+    retries: int = 0
+    cache: Optional[str] = None   # "hit" | "miss" | "partial" | None
+    error: bool = False
+
+@dataclass
+class _Series:
+    count: int = 0
+    sum_s: float = 0.0
+    buckets: List[int] = field(default_factory=lambda: [0] * (len(BUCKETS) + 1))
+    bytes: int = 0
+    retries: int = 0
+    errors: int = 0
+    cache: Dict[str, int] = field(default_factory=dict)
+    recent: Deque[float] = field(default_factory=lambda: deque(maxlen=2048))
+
+    def add(self, s: Span) -> None:
+        self.count += 1
+        self.sum_s += s.duration_s
+        self.buckets[bisect.bisect_left(BUCKETS, s.duration_s)] += 1
+        self.bytes += s.bytes
+        self.retries += s.retries
+        self.errors += int(s.error)
+        if s.cache:
+            self.cache[s.cache] = self.cache.get(s.cache, 0) + 1
+        self.recent.append(s.duration_s)
+
+    def quantile(self, q: float) -> float:
+        if not self.recent: return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * (len(ordered) - 1) + 0.5))]
+
+class MetricsRegistry:
+    """Process-wide span recorder with per (stage, op) histograms; exports JSON and Prometheus text."""
+    def __init__(self, keep_spans: int = 5000):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self.spans: Deque[Span] = deque(maxlen=keep_spans)
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self) -> Optional[Span]:
+        """Innermost open span in this thread (e.g. to add retries/bytes from a helper)."""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, op: str, stage: str) -> Iterator[Span]:
+        s = Span(op=op, stage=stage)
+        stack = self._stack()
+        stack.append(s)
+        t0 = time.perf_counter()
+        try:
+            yield s
+        except BaseException:
+            s.error = True
+            raise
+        finally:
+            s.duration_s = time.perf_counter() - t0
+            stack.pop()
+            self.record(s)
+
+    def record(self, s: Span) -> None:
+        with self._lock:
+            self.spans.append(s)
+            self._series.setdefault((s.stage, s.op), _Series()).add(s)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+            self.spans.clear()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = sorted(self._series.items())
+            return [{
+                "stage": stage, "op": op, "count": s.count, "total_s": round(s.sum_s, 3),
+                "p50_ms": round(s.quantile(0.5) * 1000, 1), "p95_ms": round(s.quantile(0.95) * 1000, 1),
+                "bytes": s.bytes, "retries": s.retries, "errors": s.errors,
+                "cache_hits": s.cache.get("hit", 0), "cache_misses": s.cache.get("miss", 0) + s.cache.get("partial", 0),
+            } for (stage, op), s in items]
+
+    def to_json(self, recent_spans: int = 200) -> str:
+        with self._lock:
+            spans = [asdict(s) for s in list(self.spans)[-recent_spans:]]
+            hist = {
+                f"{stage}/{op}": {"buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], s.buckets)), "sum_s": s.sum_s, "count": s.count}
+                for (stage, op), s in self._series.items()
+            }
+        return json.dumps({"summary": self.summary(), "histograms": hist, "recent_spans": spans}, indent=2)
+
+    def to_prometheus(self, prefix: str = "amazon_finder") -> str:
+        lines = [
+            f"# HELP {prefix}_span_duration_seconds Duration of instrumented calls.",
+            f"# TYPE {prefix}_span_duration_seconds histogram",
+        ]
+        counters: List[str] = []
+        with self._lock:
+            for (stage, op), s in sorted(self._series.items()):
+                labels = f'stage="{stage}",op="{op}"'
+                cumulative = 0
+                for bound, n in zip(list(BUCKETS) + [float("inf")], s.buckets):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{prefix}_span_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{prefix}_span_duration_seconds_sum{{{labels}}} {s.sum_s:.6f}")
+                lines.append(f"{prefix}_span_duration_seconds_count{{{labels}}} {s.count}")
+                counters.append(f"{prefix}_bytes_received_total{{{labels}}} {s.bytes}")
+                counters.append(f"{prefix}_retries_total{{{labels}}} {s.retries}")
+                counters.append(f"{prefix}_errors_total{{{labels}}} {s.errors}")
+                for outcome, n in sorted(s.cache.items()):
+                    counters.append(f'{prefix}_cache_total{{{labels},outcome="{outcome}"}} {n}')
+        return "\n".join(lines + counters) + "\n"
+
+metrics = MetricsRegistry()
+
+def instrumented(op: str, stage: str) -> Callable:
+    """Decorator: record every call of the function as a span."""
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with metrics.span(op, stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
@@ -0,0 +1,39 @@
+# utils/sqlite_store.py
+from __future__ import annotations
+import os, sqlite3, threading
+from typing import Any, Callable, Dict, Generic, Sequence, TypeVar
+
+S = TypeVar("S")
+
+class SQLiteStore:
+    """
+    Base for the app's local SQLite stores: one connection per instance (WAL mode, 30 s busy
+    timeout, usable from any thread) guarded by `_lock`. Subclasses list their CREATE statements
+    in SCHEMA; several processes can open the same file.
+    """
+    SCHEMA: Sequence[str] = ()
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        for statement in self.SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+
+class StoreRegistry(Generic[S]):
+    """One shared instance per key (usually the file path), built by `factory(key, ...)` on first use."""
+    def __init__(self, factory: Callable[..., S]):
+        self._factory = factory
+        self._items: Dict[str, S] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, *args: Any, **kwargs: Any) -> S:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                item = self._items[key] = self._factory(key, *args, **kwargs)
+            return item